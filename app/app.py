@@ -1,16 +1,162 @@
 from dash import Dash, dcc, html, Input, Output
 import dash_bootstrap_components as dbc
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+import plotly.io as pio
+import contextlib
+import flask
+import functools
 import os
+import urllib.parse
 
+# responses are gzipped: figures are json, mostly repeated names and urls
 app = Dash(
     __name__,
     title='F1',
     external_stylesheets=[dbc.themes.BOOTSTRAP],
     suppress_callback_exceptions=True,
+    compress=True,
 )
 
-db_path = os.path.join(os.path.dirname(__file__), 'data.db')
+# dash serializes its responses through plotly, which uses orjson when it's
+# installed, as figure_cache.py does for the figures. F1_JSON_ENGINE=json
+# switches both to the standard library's encoder
+pio.json.config.default_engine = os.environ.get('F1_JSON_ENGINE', 'auto')
 
-engine = create_engine(f'sqlite:///{db_path}')
+# F1_DB_PATH points the app at another database, as render_figures.py does
+db_path = os.environ.get('F1_DB_PATH', os.path.join(os.path.dirname(__file__), 'data.db'))
+shard_dir = os.path.join(os.path.dirname(__file__), 'shards')
+
+# the app only reads, and the etl never writes to a published database or
+# shard (it renames a new one into place), so files are opened read-only and
+# immutable: sqlite skips locking and change checks. reads go through a
+# memory map, so every worker shares the os page cache instead of copying
+# pages into its own cache with a read syscall each
+serving_pragmas = [
+    'PRAGMA query_only = 1',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA cache_size = -16384',
+    'PRAGMA temp_store = MEMORY',
+]
+
+
+def set_serving_pragmas(dbapi_connection, connection_record):
+    for pragma in serving_pragmas:
+        dbapi_connection.execute(pragma)
+
+
+def read_only_uri(path):
+    return f'file:{urllib.parse.quote(os.path.abspath(path))}?mode=ro&immutable=1'
+
+
+# connections are pooled rather than opened per request, so each keeps the
+# statements sqlite prepared for the app's queries (see queries.py) cached.
+# the pool hands a connection to one thread at a time
+engine = create_engine(
+    f'sqlite:///{read_only_uri(db_path)}&uri=true',
+    poolclass=QueuePool,
+    connect_args={'check_same_thread': False},
+)
+event.listen(engine, 'connect', set_serving_pragmas)
+
+
+def warm_up():
+    # reads the indexes of the report tables the charts query by, so the
+    # first requests after a worker starts or a new database is published
+    # find their pages already mapped
+    if not os.path.exists(db_path):
+        return
+
+    with engine.connect() as con:
+        indexes = con.exec_driver_sql('''
+            SELECT tbl_name, name
+            FROM sqlite_master
+            WHERE TRUE
+                AND type = 'index'
+                AND tbl_name LIKE 'report_%'
+                AND sql IS NOT NULL
+        ''').fetchall()
+
+        for table_name, index_name in indexes:
+            con.exec_driver_sql(f'SELECT COUNT(*) FROM "{table_name}" INDEXED BY "{index_name}"').fetchone()
+
+
+def warm_up_after_fork():
+    # a forked worker mustn't share its parent's sqlite connections, so it
+    # drops them without closing them and warms up its own
+    engine.dispose(close=False)
+    warm_up()
+
+
+def db_version():
+    # the etl publishes a new database by renaming a finished build over
+    # data.db, so a new inode/mtime means a new version of the data
+    try:
+        stat = os.stat(db_path)
+    except FileNotFoundError:
+        return None
+
+    return (stat.st_ino, stat.st_mtime_ns)
+
+
+db_state = {'version': db_version()}
+
+
+@app.server.before_request
+def recycle_engine_on_new_db():
+    # connections opened before a swap keep reading the old (unlinked) file,
+    # so drop them and let the pool reconnect to the new one
+    version = db_version()
+
+    if version != db_state['version']:
+        engine.dispose()
+        db_state['version'] = version
+        warm_up()
+
+
+@contextlib.contextmanager
+def season_connection(table, season):
+    # lap-level tables are stored by the etl in one database per season, listed
+    # in etl_shard. this attaches the season's shard for the table, so queries
+    # on the connection can join it to the main database's tables by name
+    with engine.connect() as con:
+        path = con.exec_driver_sql(
+            'SELECT path FROM etl_shard WHERE name = ? AND year = ?',
+            (table, int(season)),
+        ).scalar()
+
+        if path is None:
+            yield con
+            return
+
+        con.exec_driver_sql('ATTACH DATABASE ? AS season', (read_only_uri(os.path.join(shard_dir, path)),))
+        try:
+            yield con
+        finally:
+            con.exec_driver_sql('DETACH DATABASE season')
+
+
+
+# the app's internal stats are only served when it runs in debug mode, as
+# index.py runs it, or with F1_STATS=1 set. dash sets debug when the server
+# starts, after the routes are registered, so it's checked per request
+serve_stats = os.environ.get('F1_STATS') == '1'
+
+
+def stats_route(rule):
+    def decorator(view):
+        @functools.wraps(view)
+        def serve_if_enabled():
+            if not (serve_stats or app.server.debug):
+                flask.abort(404)
+
+            return view()
+
+        return app.server.route(rule, methods=['GET'])(serve_if_enabled)
+
+    return decorator
+
+
+warm_up()
+os.register_at_fork(after_in_child=warm_up_after_fork)
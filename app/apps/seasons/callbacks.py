@@ -1,12 +1,13 @@
-from dash import Dash, dcc, html, Input, Output
+from dash import ClientsideFunction, Dash, dcc, html, Input, Output, State
 import dash_bootstrap_components as dbc
 
-from app import app, engine
+from app import app
+import figure_cache
+import queries
 
 from . import charts
 
-import pandas as pd
-from flask import request, jsonify
+from flask import abort, request, jsonify
 
 
 @app.callback(
@@ -17,7 +18,37 @@ from flask import request, jsonify
     Input('seasons_top_n_input', 'value'),
 )
 def seasons_update_rank_graph(metric, cumulative, start_year, top_n):
-    return charts.seasons_rank_chart(metric, cumulative, start_year, top_n)
+    return figure_cache.send(charts.seasons_rank_chart(metric, cumulative, start_year, top_n))
+
+
+@app.server.route('/api/seasons_rank_frames', methods=['GET'])
+def seasons_rank_frames():
+    # a batch of the seasons chart's frames, fetched by assets/lazy_frames.js.
+    # anything the chart's own url wouldn't have is a bad request, so it
+    # doesn't fail in the chart or take a place in the figure cache
+    try:
+        metric = request.args['metric']
+        cumulative = request.args['cumulative']
+        start_year = int(request.args['start_year'])
+        top_n = int(request.args['top_n'])
+        batch = int(request.args['batch'])
+    except (KeyError, ValueError):
+        abort(400)
+
+    first_year, last_year = queries.read_row('season_years')
+
+    if not (
+        metric in set(queries.read('metrics')['metric'])
+        and cumulative in {'True', 'False'}
+        and first_year <= start_year <= last_year
+        and 1 <= top_n <= 1000
+        and 0 <= batch <= (last_year - first_year) // charts.frame_batch_size
+    ):
+        abort(400)
+
+    frames_json = charts.seasons_rank_frames(metric, cumulative, start_year, top_n, batch)
+
+    return app.server.response_class(frames_json, mimetype='application/json')
 
 
 @app.callback(
@@ -28,7 +59,7 @@ def seasons_update_rank_graph(metric, cumulative, start_year, top_n):
     Input('season_top_n_input', 'value'),
 )
 def seasons_update_rank_graph(metric, cumulative, season, top_n):
-    return charts.season_rank_chart(metric, cumulative, season, top_n)
+    return figure_cache.send(charts.season_rank_chart(metric, cumulative, season, top_n))
 
 
 @app.callback(
@@ -38,7 +69,7 @@ def seasons_update_rank_graph(metric, cumulative, season, top_n):
     Input('race_focus_select', 'value'),
 )
 def seasons_update_rank_graph(season, race, focus):
-    return charts.race_bump_chart(season, race, focus)
+    return figure_cache.send(charts.race_bump_chart(season, race, focus))
 
 
 app.clientside_callback(
@@ -73,6 +104,15 @@ app.clientside_callback(
 )
 
 
+# binds assets/lazy_frames.js to the seasons graph whenever it gets a figure
+app.clientside_callback(
+    ClientsideFunction(namespace='lazy_frames', function_name='watch'),
+    Output('seasons_lazy_frames_placeholder', 'children'),
+    Input('seasons_rank_graph', 'figure'),
+    State('seasons_rank_graph', 'id'),
+)
+
+
 @app.callback(
     Output('race_focus_select', 'value'),
     Input('race_bump_graph', 'clickData'),
@@ -89,21 +129,7 @@ def season_open_wiki(clickData):
     Input('race_season_select', 'value'),
 )
 def race_race_select(season):
-    races = pd.read_sql(
-        con=engine,
-        sql=f'''
-            --sql
-
-            SELECT r.name
-            FROM
-                fact_race_result AS rr
-                LEFT JOIN dim_race AS r
-                    ON rr.race_k = r.race_k
-            WHERE r.year = {season}
-            GROUP BY name
-            ORDER BY MAX(date);
-        '''
-    )['name']
+    races = queries.read('season_races', season=int(season))['name']
 
     options = [
         {'label': item, 'value': item}
@@ -119,25 +145,7 @@ def race_race_select(season):
     Input('race_race_select', 'value'),
 )
 def race_focus_select(season, race):
-    drivers = ['None'] + pd.read_sql(
-        con=engine,
-        sql=f'''
-            --sql
-            
-            SELECT d.full_name
-            FROM
-                fact_race_result AS rr
-                LEFT JOIN dim_race AS r
-                    ON rr.race_k = r.race_k
-                LEFT JOIN dim_driver AS d
-                    ON rr.driver_k = d.driver_k
-            WHERE TRUE
-                AND NOT rr.is_sprint
-                AND r.year = {season}
-                AND r.name = '{race}'
-            GROUP BY d.full_name;
-        '''
-    )['full_name'].to_list()
+    drivers = ['None'] + queries.read('race_drivers', season=int(season), race=race)['full_name'].to_list()
 
     options = [
         {'label': item, 'value': item}
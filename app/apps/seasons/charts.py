@@ -1,11 +1,40 @@
 import plotly.graph_objects as go
 import plotly.express as px
+import plotly.io as pio
 
 import pandas as pd
 import numpy as np
 import itertools as it
+import functools
+import json
+import os
+import urllib.parse
+
+from app import db_state
+import figure_cache
+import queries
+
+# figures are built as the dicts plotly serializes figures to, which dash
+# sends as they are, so plotly's validators don't run over every property of
+# every frame. the dicts are written as validation would leave them: named
+# templates expanded, subplot axes named x/x2 rather than x1/x2 and so on.
+# F1_VALIDATE_FIGURES=1 builds them through go.Figure instead, which
+# benchmark_charts.py --check compares them to
+validate_figures = os.environ.get('F1_VALIDATE_FIGURES') == '1'
+templates = {name: pio.templates[name].to_plotly_json() for name in ['gridon', 'simple_white']}
+
+
+def figure(spec):
+    return go.Figure(spec) if validate_figures else spec
+
+
+def start_traces(traces, frame):
+    # the traces an animation starts with. as plotly.js animates, it merges
+    # each frame into them, so properties that are the same in every frame
+    # are given once here and frames carry only what changes (and their type,
+    # which plotly's validators would otherwise take to be scatter)
+    return [dict(trace, **frame_trace) for trace, frame_trace in zip(traces, frame['data'])]
 
-from app import engine
 
 def text_color(background_color):
     background_color = background_color.lstrip('#')
@@ -17,165 +46,182 @@ def text_color(background_color):
     return '#FFFFFF' if brightness < 125 else '#000000'
 
 
-def seasons_rank_chart(metric, cumulative, start_year, top_n):
-    cumualtive_prefix = 'cumulative_' if cumulative == 'True' else ''
-
-    df = pd.read_sql(
-        con=engine,
-        sql=f'''
-            --sql
-            
-            WITH
-                metrics AS (
-                    SELECT
-                        year,
-                        type,
-                        id,
-                        name,
-                        constructor_name,
-                        constructor_color,
-                        wiki_url,
-                        season_wiki_url,
-                        metric_value,
-                        position,
-                        SUM(COALESCE(metric_value, 0)) OVER (
-                            PARTITION BY
-                                id,
-                                type
-                            ORDER BY
-                                year
-                            ROWS BETWEEN
-                                UNBOUNDED PRECEDING
-                                AND CURRENT ROW
-                        ) AS cumulative_metric_value
-                    FROM report_seasons_metrics
-                    WHERE TRUE
-                        AND year >= {start_year}
-                        AND metric = '{metric}'
-                ),
-                rankings AS (
-                    SELECT
-                        year,
-                        type,
-                        id,
-                        name,
-                        constructor_name,
-                        constructor_color,
-                        wiki_url,
-                        season_wiki_url,
-                        metric_value,
-                        position,
-                        cumulative_metric_value,
-                        ROW_NUMBER() OVER (PARTITION BY year, type ORDER BY cumulative_metric_value DESC) AS cumulative_position
-                    FROM metrics
-                )
-            SELECT
-                year,
-                type,
-                id,
-                name,
-                constructor_name,
-                constructor_color,
-                wiki_url,
-                season_wiki_url,
-                {cumualtive_prefix}metric_value AS metric_value,
-                {cumualtive_prefix}position AS position
-            FROM rankings
-            WHERE {cumualtive_prefix}position <= {top_n}
-            ORDER BY year, type, position DESC;
-        '''
-    )
+def rank_frames(df, frame_column):
+    # splits the rows into the animation's frames in one pass: for each value
+    # of frame_column, in the order it first appears, the positions of its
+    # driver and constructor rows and of its first row
+    groups = df.groupby([frame_column, 'type'], sort=False).indices
+    no_rows = np.array([], dtype=np.int64)
+
+    frames_data = []
+    for frame_label in pd.unique(df[frame_column]).tolist():
+        drivers = groups.get((frame_label, 'Driver'), no_rows)
+        constructors = groups.get((frame_label, 'Constructor'), no_rows)
+
+        frames_data.append({
+            'frame_label': frame_label,
+            'drivers': drivers,
+            'constructors': constructors,
+            'first_row': min(rows[0] for rows in [drivers, constructors] if len(rows)),
+        })
+
+    return frames_data
+
+
+# the seasons chart is sent with only its first frame and its slider, and the
+# browser fetches the other frames as the slider or Play reaches them, in
+# batches of frame_batch_size in slider order (see assets/lazy_frames.js), so
+# the first response doesn't grow with the seasons shown
+frame_batch_size = 8
+
 
-    frames_data = [
+def seasons_rank_read(metric, cumulative, start_year, top_n):
+    first_season = queries.read('first_season', metric=metric)['year'].iloc[0]
+
+    if cumulative == 'True' and int(start_year) > first_season:
+        query = 'seasons_rank_rebased'
+    elif cumulative == 'True':
+        query = 'seasons_rank_cumulative'
+    else:
+        query = 'seasons_rank'
+
+    return queries.read(query, metric=metric, start_year=int(start_year), top_n=int(top_n))
+
+
+def rank_frame(columns, frame_data, links):
+    # a frame of the rank charts: its driver and constructor bars, and the
+    # text of its annotations that link to pages about the frame, each a
+    # (column, label) pair. plotly.js merges a frame's annotations into the
+    # figure's one by one, so only their text is given
+    drivers = frame_data['drivers']
+    constructors = frame_data['constructors']
+
+    data = [
+        {
+            'type': 'bar',
+            'x': columns['metric_value'][drivers],
+            'y': columns['name'][drivers],
+            'marker': {'color': columns['constructor_color'][drivers]},
+            'text': columns['constructor_name'][drivers],
+            'customdata': np.dstack([
+                columns['wiki_url'][drivers],
+                columns['constructor_name'][drivers],
+            ])[0],
+        },
         {
-            'frame_label': frame['year'],
-            'df': df[df['year'] == frame['year']],
-        }
-        for frame in df[['year']].drop_duplicates().to_dict('records')
+            'type': 'bar',
+            'x': columns['metric_value'][constructors],
+            'y': columns['name'][constructors],
+            'marker': {'color': columns['constructor_color'][constructors]},
+            'text': columns['constructor_name'][constructors],
+            'customdata': np.dstack([
+                columns['wiki_url'][constructors],
+            ])[0],
+        },
     ]
 
-    def frame_figure(frame_data):
-        df = frame_data['df']
-        year = frame_data['frame_label']
-        
-        data = [
-            go.Bar(
-                x=df[df['type'] == 'Driver']['metric_value'],
-                y=df[df['type'] == 'Driver']['name'],
-                marker_color=df[df['type'] == 'Driver']['constructor_color'],
-                xaxis='x1',
-                yaxis='y1',
-                #name=F'Driver {metric}',
-                name='',
-                legendgroup=1,
-                showlegend=False,
-                orientation='h',
-                text=df[df['type'] == 'Driver']['constructor_name'],
-                customdata=np.dstack([
-                    df[df['type'] == 'Driver']['wiki_url'],
-                    df[df['type'] == 'Driver']['constructor_name'],
-                ])[0],
-                hovertemplate= '<br>'.join([
-                    'Driver: %{y}',
-                    'Constructor: %{customdata[1]}',
-                    f'{metric}: %{{x}}',
-                ]),
-            ),
-            go.Bar(
-                x=df[df['type'] == 'Constructor']['metric_value'],
-                y=df[df['type'] == 'Constructor']['name'],
-                marker_color=df[df['type'] == 'Constructor']['constructor_color'],
-                xaxis='x2',
-                yaxis='y2',
-                #name=f'Constructor {metric}',
-                name='',
-                legendgroup=2,
-                showlegend=False,
-                orientation='h',
-                text=df[df['type'] == 'Constructor']['constructor_name'],
-                customdata=np.dstack([
-                    df[df['type'] == 'Constructor']['wiki_url'],
-                ])[0],
-                hovertemplate= '<br>'.join([
-                    'Constructor: %{y}',
-                    f'{metric}: %{{x}}',
-                ]),
-            ),
-        ]
+    layout = {
+        'annotations': [
+            {'text': f'<a href="{columns[column][frame_data["first_row"]]}">{label}</a>'}
+            for column, label in links
+        ],
+    }
 
-        season_wiki_url = df['season_wiki_url'].iloc[0]
+    fig = {
+        'name': str(frame_data['frame_label']),
+        'data': data,
+        'layout': layout,
+    }
 
-        layout = {
-            'annotations': [
-                {
-                    'text': f'<a href="{season_wiki_url}">Season Wiki</a>',
-                    'align': 'left',
-                    'showarrow': False,
-                    'xref': 'paper',
-                    'yref': 'paper',
-                    'x': 1,
-                    'y': 0.475,
-                }
-            ],
-        }
+    return fig
+
+
+# the annotations each rank chart's frames change. the season's one is the
+# same in every frame of the season chart
+seasons_rank_links = [('season_wiki_url', 'Season Wiki')]
+season_rank_links = [('race_wiki_url', 'Race Wiki'), ('circuit_wiki_url', 'Circuit Wiki')]
+
+
+@functools.lru_cache(maxsize=8)
+def seasons_rank_view_frames(metric, cumulative, start_year, top_n, db_version):
+    # every frame of a view, built once for all of its batches. the database
+    # version is part of the key, so a new database's frames are built afresh
+    df = seasons_rank_read(metric, cumulative, start_year, top_n)
+    columns = {column: df[column].to_numpy() for column in df.columns}
 
-        fig = {
-            'data': data,
-            'layout': layout,
-        }
+    return [rank_frame(columns, frame_data, seasons_rank_links) for frame_data in rank_frames(df, 'year')]
 
-        return fig
+
+@figure_cache.cached
+def seasons_rank_frames(metric, cumulative, start_year, top_n, batch):
+    frames = seasons_rank_view_frames(metric, cumulative, int(start_year), int(top_n), db_state['version'])
+
+    batch = int(batch)
+    return frames[batch * frame_batch_size:(batch + 1) * frame_batch_size]
+
+
+@figure_cache.cached
+def seasons_rank_chart(metric, cumulative, start_year, top_n):
+    df = seasons_rank_read(metric, cumulative, start_year, top_n)
+
+    frames_data = rank_frames(df, 'year')
+    columns = {column: df[column].to_numpy() for column in df.columns}
+
+    frames = [rank_frame(columns, frames_data[0], seasons_rank_links)]
+    traces = [
+        {
+            'type': 'bar',
+            'xaxis': 'x',
+            'yaxis': 'y',
+            #'name': F'Driver {metric}',
+            'name': '',
+            'legendgroup': '1',
+            'showlegend': False,
+            'orientation': 'h',
+            'hovertemplate': '<br>'.join([
+                'Driver: %{y}',
+                'Constructor: %{customdata[1]}',
+                f'{metric}: %{{x}}',
+            ]),
+        },
+        {
+            'type': 'bar',
+            'xaxis': 'x2',
+            'yaxis': 'y2',
+            #'name': f'Constructor {metric}',
+            'name': '',
+            'legendgroup': '2',
+            'showlegend': False,
+            'orientation': 'h',
+            'hovertemplate': '<br>'.join([
+                'Constructor: %{y}',
+                f'{metric}: %{{x}}',
+            ]),
+        },
+    ]
 
     season_wiki_url = df['season_wiki_url'].iloc[0]
+    frames_url = '/api/seasons_rank_frames?' + urllib.parse.urlencode({
+        'metric': metric,
+        'cumulative': cumulative,
+        'start_year': start_year,
+        'top_n': top_n,
+    })
 
-    fig = go.Figure({
-        'data': frame_figure(frames_data[0])['data'],
+    fig = figure({
+        'data': start_traces(traces, frames[0]),
         'layout': {
+            'meta': {
+                'lazy_frames': {
+                    'url': frames_url,
+                    'batch_size': frame_batch_size,
+                },
+            },
             'title': {
                 'text': f"{'Cumulative ' if cumulative == 'True' else ''}{metric} by Season and Driver/Constructor",
                 'y': 0.975
             },
-            'template': 'gridon',
+            'template': templates['gridon'],
             'height': 720,
             'margin': {
                 't': 50,
@@ -190,22 +236,22 @@ def seasons_rank_chart(metric, cumulative, start_year, top_n):
                 'size': 16,
             },
             'hovermode': 'y',
-            'xaxis1': {
-                #'title': metric,
+            'xaxis': {
+                #'title': {'text': metric},
                 'range': [0, df[df['type'] == 'Driver']['metric_value'].max()],
-                'anchor': 'y1',
+                'anchor': 'y',
             },
             'xaxis2': {
-                'title': metric,
+                'title': {'text': metric},
                 'range': [0, df[df['type'] == 'Constructor']['metric_value'].max()],
                 'anchor': 'y2',
             },
-            'yaxis1': {
-                'title': 'Driver',
+            'yaxis': {
+                'title': {'text': 'Driver'},
                 'domain': [0.6, 1],
             },
             'yaxis2': {
-                'title': 'Constructor',
+                'title': {'text': 'Constructor'},
                 'domain': [0, 0.4]
             },
             'annotations': [
@@ -246,8 +292,10 @@ def seasons_rank_chart(metric, cumulative, start_year, top_n):
                                     }
                                 }
                             ],
+                            # plotly.js would only play the frames it has,
+                            # so lazy_frames.js plays them, with these args
                             'label': 'Play',
-                            'method': 'animate',
+                            'method': 'skip',
                         },
                         {
                             'args': [
@@ -318,149 +366,70 @@ def seasons_rank_chart(metric, cumulative, start_year, top_n):
                 ]
             }]
         },
-        'frames': [
-            {
-                'name': str(frame['frame_label']),
-                'data': frame_figure(frame)['data'],
-                'layout': frame_figure(frame)['layout'],
-            }
-            for frame in frames_data
-        ]
+        'frames': frames,
     })
 
     return fig
 
 
+@figure_cache.cached
 def season_rank_chart(metric, cumulative, season, top_n):
-    df = pd.read_sql(
-        con=engine,
-        sql=f'''
-            --sql
-            
-            SELECT *
-            FROM report_season_metrics
-            WHERE TRUE
-                AND year = {season}
-                AND metric = '{metric}'
-                AND {'' if cumulative == 'True' else 'not '} is_cumulative
-                AND position <= {top_n}
-            ORDER BY race_date, type, position DESC;
-        '''
+    df = queries.read(
+        'season_rank',
+        season=int(season),
+        metric=metric,
+        is_cumulative=int(cumulative == 'True'),
+        top_n=int(top_n),
     )
 
-    frames_data = [
+    frames_data = rank_frames(df, 'race')
+    columns = {column: df[column].to_numpy() for column in df.columns}
+
+    frames = [rank_frame(columns, frame_data, season_rank_links) for frame_data in frames_data]
+    traces = [
+        {
+            'type': 'bar',
+            'xaxis': 'x',
+            'yaxis': 'y',
+            #'name': 'Driver Points',
+            'name': '',
+            'legendgroup': '1',
+            'showlegend': False,
+            'orientation': 'h',
+            'hovertemplate': '<br>'.join([
+                'Driver: %{y}',
+                'Constructor: %{customdata[1]}',
+                f'{metric}: %{{x}}',
+            ]),
+        },
         {
-            'frame_label': frame['race'],
-            'df': df[df['race'] == frame['race']],
-        }
-        for frame in df[['race']].drop_duplicates().to_dict('records')
+            'type': 'bar',
+            'xaxis': 'x2',
+            'yaxis': 'y2',
+            #'name': 'Constructor Points',
+            'name': '',
+            'legendgroup': '2',
+            'showlegend': False,
+            'orientation': 'h',
+            'hovertemplate': '<br>'.join([
+                'Constructor: %{y}',
+                f'{metric}: %{{x}}',
+            ]),
+        },
     ]
 
-    def frame_figure(frame_data):
-        df = frame_data['df']
-        race = frame_data['frame_label']
-        
-        data = [
-            go.Bar(
-                x=df[df['type'] == 'Driver']['metric_value'],
-                y=df[df['type'] == 'Driver']['name'],
-                marker_color=df[df['type'] == 'Driver']['constructor_color'],
-                xaxis='x1',
-                yaxis='y1',
-                #name='Driver Points',
-                name='',
-                legendgroup=1,
-                showlegend=False,
-                orientation='h',
-                text=df[df['type'] == 'Driver']['constructor_name'],
-                customdata=np.dstack([
-                    df[df['type'] == 'Driver']['wiki_url'],
-                    df[df['type'] == 'Driver']['constructor_name'],
-                ])[0],
-                hovertemplate= '<br>'.join([
-                    'Driver: %{y}',
-                    'Constructor: %{customdata[1]}',
-                    f'{metric}: %{{x}}',
-                ]),
-            ),
-            go.Bar(
-                x=df[df['type'] == 'Constructor']['metric_value'],
-                y=df[df['type'] == 'Constructor']['name'],
-                marker_color=df[df['type'] == 'Constructor']['constructor_color'],
-                xaxis='x2',
-                yaxis='y2',
-                #name='Constructor Points',
-                name='',
-                legendgroup=2,
-                showlegend=False,
-                orientation='h',
-                text=df[df['type'] == 'Constructor']['constructor_name'],
-                customdata=np.dstack([
-                    df[df['type'] == 'Constructor']['wiki_url'],
-                ])[0],
-                hovertemplate= '<br>'.join([
-                    'Constructor: %{y}',
-                    f'{metric}: %{{x}}',
-                ]),
-            ),
-        ]
-
-        race_wiki_url = df['race_wiki_url'].iloc[0]
-        circuit_wiki_url = df['circuit_wiki_url'].iloc[0]
-        season_wiki_url = df['season_wiki_url'].iloc[0]
-
-        layout = {
-            'annotations': [
-                {
-                    'text': f'<a href="{race_wiki_url}">Race Wiki</a>',
-                    'align': 'left',
-                    'showarrow': False,
-                    'xref': 'paper',
-                    'yref': 'paper',
-                    'x': 1,
-                    'y': 0.475,
-                },
-                {
-                    'text': f'<a href="{circuit_wiki_url}">Circuit Wiki</a>',
-                    'align': 'left',
-                    'showarrow': False,
-                    'xref': 'paper',
-                    'yref': 'paper',
-                    'x': 1,
-                    
-                    'y': 0.525,
-                },
-                {
-                    'text': f'<a href="{season_wiki_url}">Season Wiki</a>',
-                    'align': 'left',
-                    'showarrow': False,
-                    'xref': 'paper',
-                    'yref': 'paper',
-                    'x': 1,
-                    'y': 0.425,
-                },
-            ],
-        }
-
-        fig = {
-            'data': data,
-            'layout': layout,
-        }
-
-        return fig
-
     race_wiki_url = df['race_wiki_url'].iloc[0]
     circuit_wiki_url = df['circuit_wiki_url'].iloc[0]
     season_wiki_url = df['season_wiki_url'].iloc[0]
 
-    fig = go.Figure({
-        'data': frame_figure(frames_data[0])['data'],
+    fig = figure({
+        'data': start_traces(traces, frames[0]),
         'layout': {
             'title': {
                 'text': f"{'Cumulative ' if cumulative == 'True' else ''}{metric} by Race and Driver/Constructor in {season}",
                 'y': 0.975
             },
-            'template': 'gridon',
+            'template': templates['gridon'],
             'height': 720,
             'margin': {
                 't': 50,
@@ -475,22 +444,22 @@ def season_rank_chart(metric, cumulative, season, top_n):
                 'size': 16,
             },
             'hovermode': 'y',
-            'xaxis1': {
-                #'title': metric,
+            'xaxis': {
+                #'title': {'text': metric},
                 'range': [0, df[df['type'] == 'Driver']['metric_value'].max()],
-                'anchor': 'y1',
+                'anchor': 'y',
             },
             'xaxis2': {
-                'title': metric,
+                'title': {'text': metric},
                 'range': [0, df[df['type'] == 'Constructor']['metric_value'].max()],
                 'anchor': 'y2',
             },
-            'yaxis1': {
-                'title': 'Driver',
+            'yaxis': {
+                'title': {'text': 'Driver'},
                 'domain': [0.6, 1],
             },
             'yaxis2': {
-                'title': 'Constructor',
+                'title': {'text': 'Constructor'},
                 'domain': [0, 0.4]
             },
             'annotations': [
@@ -622,69 +591,73 @@ def season_rank_chart(metric, cumulative, season, top_n):
                 ]
             }]
         },
-        'frames': [
-            {
-                'name': str(frame['frame_label']),
-                'data': frame_figure(frame)['data'],
-                'layout': frame_figure(frame)['layout'],
-            }
-            for frame in frames_data
-        ]
+        'frames': frames,
     })
 
     return fig
 
+@figure_cache.cached
 def race_bump_chart(season, race, focus):
-    df = pd.read_sql(
-        con=engine,
-        sql=f'''
-            --sql
-            
-            SELECT *
-            FROM report_race_metrics
-            WHERE TRUE
-                AND year = {season}
-                AND race_name = '{race}'
-            ORDER BY year, race_date, constructor_name, driver_name, lap;
-        '''
-    )
+    # the etl packs each race into one row: a drivers x laps matrix of
+    # positions, 0 where a driver has no lap, and each driver's name, code,
+    # constructor, colour and ending status, in drawing order
+    row = queries.read_row('race_positions', season=int(season), race=race)
 
-    fig = go.Figure({
+    laps, dtype, packed_positions, drivers = row if row is not None else (0, '|i1', b'', '[]')
+    drivers = json.loads(drivers)
+    positions = np.frombuffer(packed_positions, dtype=dtype).reshape(len(drivers), laps)
+    driver_laps = [np.flatnonzero(driver_positions) for driver_positions in positions]
+
+    # labels are ordered by position the way pandas sorts them, so ties keep
+    # the same order as before the positions were packed
+    finishers = [i for i, driver in enumerate(drivers) if driver[4] is not None and len(driver_laps[i])]
+    finishers = [
+        finishers[j]
+        for j in np.argsort(
+            np.array([positions[i, driver_laps[i][-1]] for i in finishers], dtype=np.int64),
+            kind='quicksort',
+        )
+    ]
+    starters = [i for i in range(len(drivers)) if laps and positions[i, 0]]
+    starters = [
+        starters[j]
+        for j in np.argsort(np.array([positions[i, 0] for i in starters], dtype=np.int64), kind='quicksort')
+    ]
+
+    fig = figure({
         'data': [
-            go.Scatter(
-                x=df[df['driver_name'] == driver_name]['lap'],
-                y=df[df['driver_name'] == driver_name]['position'],
-                xaxis='x1',
-                yaxis='y1',
-                marker_color=df[df['driver_name'] == driver_name]['constructor_color'].iloc[0],
-                name=driver_name,
-                showlegend=False,
-                mode='lines+markers+text',
-                text=df[df['driver_name'] == driver_name]['ending_status'],
-                marker={
+            {
+                'type': 'scatter',
+                'x': driver_laps[i],
+                'y': positions[i, driver_laps[i]],
+                'xaxis': 'x',
+                'yaxis': 'y',
+                'name': driver_name,
+                'showlegend': False,
+                'mode': 'lines+markers+text',
+                'text': [None] * (len(driver_laps[i]) - 1) + [ending_status],
+                'marker': {
+                    'color': constructor_color,
                     'size': 10,
                 },
-                line={
+                'line': {
                     'width': 10,
                 },  
-                textposition='middle right',
-                opacity=0.75 if focus in [driver_name, 'None'] else 0.25,
-                customdata=np.dstack([
-                    df[df['driver_name'] == driver_name]['driver_name'],
-                    df[df['driver_name'] == driver_name]['constructor_name'],
-                ])[0],
-                hovertemplate= '<br>'.join([
+                'textposition': 'middle right',
+                'opacity': 0.75 if focus in [driver_name, 'None'] else 0.25,
+                'customdata': [[driver_name, constructor_name]] * len(driver_laps[i]),
+                'hovertemplate': '<br>'.join([
                     'Driver: %{customdata[0]}',
                     'Constructor: %{customdata[1]}',
                     'Lap: %{x}',
                     'Position: %{y}',
                 ]),
-            )
-            for driver_name in df['driver_name'].unique()
+            }
+            for i, (driver_name, _, constructor_name, constructor_color, ending_status) in enumerate(drivers)
         ],
         'layout': {
-            'title': f'{season} {race} Bump Chart',
-            'template': 'simple_white',
+            'title': {'text': f'{season} {race} Bump Chart'},
+            'template': templates['simple_white'],
             'height': 720,
             'margin': {
                 'r': 50,
@@ -692,14 +665,14 @@ def race_bump_chart(season, race, focus):
             'font': {
                 'size': 16,
             },
-            'xaxis1': {
-                'title': 'Lap #',
-                'range': [-0, df['lap'].max() * 1.071],
+            'xaxis': {
+                'title': {'text': 'Lap #'},
+                'range': [-0, (laps - 1) * 1.071],
                 #'domain': [0.2, 0.8],
             },
-            'yaxis1': {
-                'title':'Position',
-                'range': [df['position'].max() + 0.2, 0.7],
+            'yaxis': {
+                'title': {'text': 'Position'},
+                'range': [int(positions.max(initial=0)) + 0.2, 0.7],
                 'visible': False,
             },
             'annotations': [
@@ -714,40 +687,40 @@ def race_bump_chart(season, race, focus):
                 }
             ] + [
                 {
-                    'text': row['driver_code'],
+                    'text': drivers[i][1],
                     'font': {
-                        'color': text_color(row['constructor_color'])
+                        'color': text_color(drivers[i][3])
                     },
                     'align': 'center',
                     'showarrow': False,
-                    'xref': 'x1',
+                    'xref': 'x',
                     'xanchor': 'left',
-                    'yref': 'y1',
-                    'x': df['lap'].max() * 1.071,
-                    'y': row['position'],
-                    'bgcolor': row['constructor_color'],
+                    'yref': 'y',
+                    'x': (laps - 1) * 1.071,
+                    'y': int(positions[i, driver_laps[i][-1]]),
+                    'bgcolor': drivers[i][3],
                     'width': 40,
                 }
-                for row in df[~df['ending_status'].isna()].sort_values(by='position').to_dict('records')
+                for i in finishers
             ] + [
                 {
-                    'text': row['driver_code'],
+                    'text': drivers[i][1],
                     'font': {
-                        'color': text_color(row['constructor_color'])
+                        'color': text_color(drivers[i][3])
                     },
                     'align': 'center',
                     'showarrow': False,
-                    'xref': 'x1',
+                    'xref': 'x',
                     'xanchor': 'right',
-                    'yref': 'y1',
+                    'yref': 'y',
                     'x': 0,
-                    'y': row['position'],
-                    'bgcolor': row['constructor_color'],
+                    'y': int(positions[i, 0]),
+                    'bgcolor': drivers[i][3],
                     'width': 40,
                 }
-                for row in df[df['lap'] == 0].sort_values(by='position').to_dict('records')
+                for i in starters
             ]
         },
     })
 
-    return fig
\ No newline at end of file
+    return fig
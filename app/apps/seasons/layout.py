@@ -227,6 +227,7 @@ def layout(url):
         ),
         html.Div(id='seasons_placeholder'),
         html.Div(id='season_placeholder'),
+        html.Div(id='seasons_lazy_frames_placeholder'),
     ]
 
     return contents
\ No newline at end of file
@@ -0,0 +1,186 @@
+// the seasons chart is sent with only its first frame. its layout.meta has the
+// url of the rest, fetched in batches of batch_size frames in slider order as
+// the slider or Play reaches them, and added to the graph. batches are kept,
+// so a view shown again doesn't fetch them again (see apps/seasons/charts.py)
+(function () {
+    var batches = {};
+
+    function lazyFrames(gd) {
+        return gd.layout && gd.layout.meta && gd.layout.meta.lazy_frames;
+    }
+
+    function steps(gd) {
+        return gd.layout.sliders[0].steps;
+    }
+
+    function hasFrame(gd, index) {
+        return Boolean(gd._transitionData._frameHash[steps(gd)[index].label]);
+    }
+
+    function loadBatch(gd, batch) {
+        var lazy = lazyFrames(gd);
+        var url = lazy.url + '&batch=' + batch;
+
+        if (!batches[url]) {
+            batches[url] = fetch(url).then(function (response) {
+                if (!response.ok) {
+                    throw new Error('fetching ' + url + ' failed: ' + response.status);
+                }
+                return response.json();
+            }).catch(function (error) {
+                delete batches[url];
+                throw error;
+            });
+        }
+
+        return batches[url].then(function (frames) {
+            // the figure may have been replaced while its frames were fetched
+            if (lazyFrames(gd) !== lazy) {
+                return;
+            }
+
+            var missing = frames.filter(function (frame) {
+                return !gd._transitionData._frameHash[frame.name];
+            });
+
+            if (missing.length) {
+                return Plotly.addFrames(gd, missing);
+            }
+        });
+    }
+
+    function load(gd, index) {
+        // the frame's batch, and past its middle, the next one ahead of time
+        var batchSize = lazyFrames(gd).batch_size;
+        var batch = Math.floor(index / batchSize);
+
+        if (index % batchSize >= batchSize / 2 && (batch + 1) * batchSize < steps(gd).length) {
+            loadBatch(gd, batch + 1).catch(console.error);
+        }
+
+        return loadBatch(gd, batch);
+    }
+
+    function play(gd, options) {
+        // as plotly.js plays frames from the current one, one animate each
+        var playing = {};
+        gd._lazyFramesPlaying = playing;
+
+        function playFrom(index) {
+            if (gd._lazyFramesPlaying !== playing || index >= steps(gd).length) {
+                return;
+            }
+
+            return load(gd, index).then(function () {
+                if (gd._lazyFramesPlaying === playing) {
+                    return Plotly.animate(gd, [steps(gd)[index].label], options).then(function () {
+                        return playFrom(index + 1);
+                    });
+                }
+            });
+        }
+
+        // pausing interrupts the animation, which rejects
+        playFrom(gd.layout.sliders[0].active || 0).catch(function () {}).then(function () {
+            if (gd._lazyFramesPlaying === playing) {
+                gd._lazyFramesPlaying = null;
+            }
+        });
+    }
+
+    function shown(gd) {
+        // a new figure starts with its first batch
+        var lazy = lazyFrames(gd);
+
+        if (lazy && gd._lazyFramesShown !== lazy) {
+            gd._lazyFramesShown = lazy;
+            gd._lazyFramesPlaying = null;
+            load(gd, gd.layout.sliders[0].active || 0).catch(console.error);
+        }
+    }
+
+    function bind(gd) {
+        if (gd._lazyFramesBound) {
+            return;
+        }
+        gd._lazyFramesBound = true;
+
+        gd.on('plotly_afterplot', function () {
+            shown(gd);
+        });
+
+        gd.on('plotly_buttonclicked', function (event) {
+            if (!lazyFrames(gd)) {
+                return;
+            }
+
+            gd._lazyFramesPlaying = null;
+            if (event.button.method === 'skip') {
+                play(gd, event.button.args[1]);
+            }
+        });
+
+        gd.on('plotly_sliderchange', function (event) {
+            if (!lazyFrames(gd) || !event.interaction) {
+                return;
+            }
+
+            // plotly.js animates to frames it has. others are animated to once
+            // they're loaded, unless the slider has moved on by then
+            var index = event.slider.active;
+            var missing = !hasFrame(gd, index);
+            gd._lazyFramesPlaying = null;
+
+            load(gd, index).then(function () {
+                if (missing && gd.layout.sliders[0].active === index) {
+                    return Plotly.animate(gd, [event.step.label], event.step.args[1]);
+                }
+            }).catch(console.error);
+        });
+
+        // the figure it's bound to may have been drawn already
+        shown(gd);
+    }
+
+    function watch(container) {
+        // dash renders a placeholder until plotly.js has loaded, then the
+        // graph, which plotly.js draws into. only the graph's container is
+        // observed, and only until the graph is drawn, so plotly.js redrawing
+        // it doesn't run the observer on every frame
+        function bindDrawn() {
+            var gd = container.querySelector('.js-plotly-plot');
+
+            if (gd) {
+                bind(gd);
+            }
+
+            return Boolean(gd);
+        }
+
+        if (!bindDrawn()) {
+            var observer = new MutationObserver(function () {
+                if (bindDrawn()) {
+                    observer.disconnect();
+                }
+            });
+            observer.observe(container, {childList: true, subtree: true});
+        }
+    }
+
+    // run by a clientside callback whenever the graph is given a figure (see
+    // apps/seasons/callbacks.py). the graph's container is dcc.Loading's
+    // div, which stays while the graph's own div is replaced on loading
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        lazy_frames: {
+            watch: function (figure, graphId) {
+                var graph = document.getElementById(graphId);
+
+                if (graph) {
+                    watch(graph.parentElement);
+                }
+
+                return window.dash_clientside.no_update;
+            },
+        },
+    });
+})();
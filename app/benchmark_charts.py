@@ -0,0 +1,143 @@
+import argparse
+import gzip
+import json
+import statistics
+import sys
+import time
+
+from apps.seasons import charts
+import figure_cache
+
+
+# times building each chart at a few views, from the database to the figure
+# the callbacks return. the charts are called undecorated, so no cache is hit:
+#   python benchmark_charts.py --repeat 5
+# with --check, it instead checks that each view's figure serializes the same
+# built as a plain dict as it does through plotly's validators, and with
+# --sizes it reports the size of each view's figure as the browser gets it,
+# before and after gzip, failing if one is over its chart's budget
+views = [
+    ('seasons_rank_chart', ('Podiums', 'True', 1950, 10)),
+    ('seasons_rank_chart', ('Points', 'False', 1950, 10)),
+    ('seasons_rank_chart', ('Points', 'True', 1990, 20)),
+    ('seasons_rank_frames', ('Podiums', 'True', 1950, 10, 0)),
+    ('season_rank_chart', ('Points', 'True', 2021, 10)),
+    ('season_rank_chart', ('Race Wins', 'False', 1975, 10)),
+    ('race_bump_chart', (2021, 'Abu Dhabi Grand Prix', 'None')),
+]
+
+
+# bytes of json per figure, before gzip, which is what the browser parses.
+# the seasons chart is sent with one frame, and its others in batches
+payload_budgets = {
+    'seasons_rank_chart': 32 * 1024,
+    'seasons_rank_frames': 32 * 1024,
+    'season_rank_chart': 64 * 1024,
+    'race_bump_chart': 96 * 1024,
+}
+
+
+def benchmark(chart_name, chart_args, repeat):
+    chart = getattr(charts, chart_name).__wrapped__
+    seconds = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chart(*chart_args)
+        seconds.append(time.perf_counter() - start)
+
+    return statistics.median(seconds)
+
+
+def payload_sizes(chart_name, chart_args):
+    figure_json = figure_cache.to_json(getattr(charts, chart_name).__wrapped__(*chart_args))
+
+    return len(figure_json), len(gzip.compress(figure_json))
+
+
+def check(chart_name, chart_args):
+    chart = getattr(charts, chart_name).__wrapped__
+    serialized = {}
+
+    for validate_figures in [False, True]:
+        charts.validate_figures = validate_figures
+        serialized[validate_figures] = json.loads(figure_cache.to_json(chart(*chart_args)))
+
+    charts.validate_figures = False
+
+    return differences(serialized[True], serialized[False])
+
+
+def differences(validated, fast, path=''):
+    # the paths at which two serialized figures differ
+    if isinstance(validated, dict) and isinstance(fast, dict):
+        return [
+            difference
+            for key in sorted(set(validated) | set(fast))
+            for difference in differences(validated.get(key), fast.get(key), f'{path}.{key}')
+        ]
+
+    if isinstance(validated, list) and isinstance(fast, list) and len(validated) == len(fast):
+        return [
+            difference
+            for i, (validated_item, fast_item) in enumerate(zip(validated, fast))
+            for difference in differences(validated_item, fast_item, f'{path}[{i}]')
+        ]
+
+    return [] if validated == fast else [f'{path}: {validated!r} validated, {fast!r} fast']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='time building the charts')
+    parser.add_argument('--repeat', type=int, default=5, help='builds per view, the median is reported')
+    parser.add_argument(
+        '--check', action='store_true',
+        help='check the figures built as plain dicts against the validated ones instead',
+    )
+    parser.add_argument(
+        '--sizes', action='store_true',
+        help="report the figures' sizes against their budgets instead",
+    )
+    args = parser.parse_args()
+
+    if args.sizes:
+        over_budget = []
+
+        for chart_name, chart_args in views:
+            size, gzipped_size = payload_sizes(chart_name, chart_args)
+            budget = payload_budgets[chart_name]
+            print(
+                f'{chart_name}{chart_args}: {size / 1024:.1f}KB, {gzipped_size / 1024:.1f}KB gzipped'
+                f' ({size / budget:.0%} of budget)'
+            )
+
+            if size > budget:
+                over_budget.append(chart_name)
+
+        if over_budget:
+            print(f'over budget: {", ".join(sorted(set(over_budget)))}')
+            sys.exit(1)
+
+        sys.exit(0)
+
+    if args.check:
+        mismatched = []
+
+        for chart_name, chart_args in views:
+            chart_differences = check(chart_name, chart_args)
+            print(f'{chart_name}{chart_args}: {len(chart_differences)} differences')
+            for difference in chart_differences[:10]:
+                print(f'  {difference}')
+
+            if chart_differences:
+                mismatched.append(chart_name)
+
+        sys.exit(1 if mismatched else 0)
+
+    # the first build of a chart also pays for imports and warming up
+    for chart_name, chart_args in views:
+        benchmark(chart_name, chart_args, 1)
+
+    for chart_name, chart_args in views:
+        seconds = benchmark(chart_name, chart_args, args.repeat)
+        print(f'{chart_name}{chart_args}: {seconds * 1000:.1f}ms')
@@ -0,0 +1,271 @@
+from collections import OrderedDict
+from flask import g, has_request_context, jsonify, request
+from sqlalchemy.exc import OperationalError
+import numpy as np
+import plotly.io as pio
+import functools
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+import zlib
+
+from app import app, db_state, db_version, stats_route
+import queries
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# charts are pure functions of their arguments, their code and the published
+# database, so each worker keeps the figures it has built, keyed on all three,
+# and drops the least recently used once they outgrow the budget. figures are
+# kept as the json sent to the browser, so a hit is never serialized again
+budget_bytes = 64 * 1024 * 1024
+
+entries = OrderedDict()
+state = {'version': None, 'bytes': 0}
+stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'precomputed_hits': 0, 'shared_hits': 0, 'shared_errors': 0}
+lock = threading.Lock()
+
+# behind each worker's figures is a cache file every worker on the box shares,
+# holding the figures' json, so a figure is built once per box rather than
+# once per worker, and outlives the workers that built it. it's trimmed to its
+# budget oldest first, and rows of older databases are dropped on each write
+shared_path = os.path.join(os.path.dirname(__file__), 'figure_cache.db')
+shared_budget_bytes = 256 * 1024 * 1024
+
+
+# a hash of each cached chart's module source, so figures built by other code
+# aren't served from the shared cache or the database
+chart_signatures = {}
+
+
+def figure_key(chart_name, args, kwargs):
+    # arguments arrive from the browser as numbers or strings depending on the
+    # control, and the charts convert them, so they're keyed as strings
+    return repr((
+        chart_name,
+        chart_signatures[chart_name],
+        tuple(str(arg) for arg in args),
+        tuple((name, str(value)) for name, value in sorted(kwargs.items())),
+    ))
+
+
+def orjson_default(value):
+    # orjson writes numeric arrays itself and hands back the rest
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if hasattr(value, 'to_plotly_json'):
+        return value.to_plotly_json()
+
+    raise TypeError(f'{type(value).__name__} is not json serializable')
+
+
+def to_json(figure):
+    # charts return plain dicts of numpy columns, or go.Figure when validating
+    # them. orjson writes them as plotly's encoders do, an order of magnitude
+    # faster. F1_JSON_ENGINE (see app.py) picks the standard library's instead
+    if orjson is not None and pio.json.config.default_engine != 'json':
+        return orjson.dumps(figure, default=orjson_default, option=orjson.OPT_SERIALIZE_NUMPY)
+
+    return pio.json.to_json_plotly(figure).encode()
+
+
+def precomputed_get(key):
+    # the etl renders the most viewed figures into the database it publishes
+    # (see render_figures.py). databases from before that have no such table
+    try:
+        row = queries.read_row('precomputed_figure', key=key)
+    except OperationalError:
+        return None
+
+    return zlib.decompress(row[0]) if row is not None else None
+
+
+def shared_connect():
+    # connections aren't kept, so forked workers never share one
+    con = sqlite3.connect(shared_path, timeout=1, isolation_level=None)
+    con.execute('PRAGMA journal_mode = WAL')
+    con.execute('''
+        CREATE TABLE IF NOT EXISTS figure (
+            key TEXT PRIMARY KEY,
+            version TEXT NOT NULL,
+            json TEXT NOT NULL,
+            bytes INTEGER NOT NULL,
+            created REAL NOT NULL
+        )
+    ''')
+
+    return con
+
+
+def shared_get(key):
+    try:
+        con = shared_connect()
+        try:
+            row = con.execute('SELECT CAST(json AS BLOB) FROM figure WHERE key = ?', (key,)).fetchone()
+        finally:
+            con.close()
+    except sqlite3.Error:
+        with lock:
+            stats['shared_errors'] += 1
+        return None
+
+    return row[0] if row is not None else None
+
+
+def shared_put(key, version, figure_json):
+    # a worker that can't get the write lock in time just doesn't share this
+    # one, and one still serving a replaced database doesn't share at all, so
+    # it can't drop the rows of the new one
+    if version != repr(db_version()):
+        return
+
+    try:
+        con = shared_connect()
+        try:
+            con.execute('BEGIN IMMEDIATE')
+            con.execute('DELETE FROM figure WHERE version <> ?', (version,))
+            con.execute(
+                'INSERT OR REPLACE INTO figure (key, version, json, bytes, created) VALUES (?, ?, ?, ?, ?)',
+                (key, version, figure_json, len(figure_json), time.time()),
+            )
+            con.execute('''
+                DELETE FROM figure
+                WHERE key IN (
+                    SELECT key
+                    FROM (
+                        SELECT
+                            key,
+                            SUM(bytes) OVER (ORDER BY created DESC, key) AS total_bytes
+                        FROM figure
+                    )
+                    WHERE total_bytes > ?
+                )
+            ''', (shared_budget_bytes,))
+            con.execute('COMMIT')
+        finally:
+            con.close()
+    except sqlite3.Error:
+        with lock:
+            stats['shared_errors'] += 1
+
+
+def cached(chart):
+    # the cached chart returns its figure's json, as bytes. callbacks pass it
+    # to send, below
+    chart_signatures[chart.__name__] = hashlib.sha1(
+        inspect.getsource(sys.modules[chart.__module__]).encode()
+    ).hexdigest()
+
+    @functools.wraps(chart)
+    def cached_chart(*args, **kwargs):
+        version = db_state['version']
+        figure_id = figure_key(chart.__name__, args, kwargs)
+        key = (figure_id, version)
+
+        with lock:
+            # figures of an older database can't be hit again
+            if state['version'] != version:
+                entries.clear()
+                state.update(version=version, bytes=0)
+
+            entry = entries.get(key)
+            if entry is not None:
+                entries.move_to_end(key)
+                stats['hits'] += 1
+                return entry[0]
+
+            stats['misses'] += 1
+
+        shared_key = repr(key)
+        figure_json = precomputed_get(figure_id)
+
+        if figure_json is not None:
+            with lock:
+                stats['precomputed_hits'] += 1
+        else:
+            figure_json = shared_get(shared_key)
+
+            if figure_json is not None:
+                with lock:
+                    stats['shared_hits'] += 1
+            else:
+                figure_json = to_json(chart(*args, **kwargs))
+                shared_put(shared_key, repr(version), figure_json)
+
+        size = len(figure_json)
+
+        with lock:
+            if state['version'] == version and key not in entries and size <= budget_bytes:
+                entries[key] = (figure_json, size)
+                state['bytes'] += size
+
+                while state['bytes'] > budget_bytes:
+                    _, (_, evicted_size) = entries.popitem(last=False)
+                    state['bytes'] -= evicted_size
+                    stats['evictions'] += 1
+
+        return figure_json
+
+    return cached_chart
+
+
+# dash's view for callback requests, which serializes each callback's return
+# value into the response
+dispatch_endpoint = f'{app.config.routes_pathname_prefix}_dash-update-component'
+
+
+def send(figure_json):
+    # a callback returns a placeholder in place of the figure, which is
+    # swapped for the figure's json once dash has serialized the rest of the
+    # response, so the figure isn't decoded only to be encoded again
+    if not has_request_context() or request.endpoint != dispatch_endpoint:
+        return json.loads(figure_json)
+
+    placeholder = f'figure-{uuid.uuid4().hex}'
+    g.setdefault('figures', {})[placeholder] = figure_json
+
+    return placeholder
+
+
+def send_figures(dispatch):
+    # wraps dash's view rather than hooking after_request, so the figures are
+    # in the response before any hook, like flask-compress's, sees it
+    @functools.wraps(dispatch)
+    def dispatch_and_send_figures(*args, **kwargs):
+        response = dispatch(*args, **kwargs)
+        figures = g.pop('figures', None)
+
+        if figures:
+            body = response.get_data()
+            for placeholder, figure_json in figures.items():
+                quoted_placeholder = f'"{placeholder}"'.encode()
+                if quoted_placeholder not in body:
+                    raise RuntimeError(f'figure placeholder {placeholder} is missing from the callback response')
+
+                body = body.replace(quoted_placeholder, figure_json, 1)
+            response.set_data(body)
+
+        return response
+
+    return dispatch_and_send_figures
+
+
+app.server.view_functions[dispatch_endpoint] = send_figures(app.server.view_functions[dispatch_endpoint])
+
+
+@stats_route('/api/figure_cache_stats')
+def figure_cache_stats():
+    with lock:
+        return jsonify(dict(stats, entries=len(entries), bytes=state['bytes'], budget_bytes=budget_bytes))
@@ -0,0 +1,373 @@
+import numpy as np
+import pandas as pd
+import os
+import threading
+
+from app import db_state, engine, season_connection
+
+
+# an optional engine, turned on with F1_DATA_ENGINE=memory, that answers the
+# chart queries from numpy columns held in memory instead of sqlite. the report
+# tables are loaded when the app is imported, so under gunicorn --preload the
+# workers forked afterwards share them copy-on-write. text columns are held as
+# integer codes into an array of their distinct values, so reading them doesn't
+# touch (and copy) shared pages the way python strings' refcounts would. a
+# worker reloads its own copy when a new database is published
+enabled = os.environ.get('F1_DATA_ENGINE') == 'memory'
+
+data = {'version': None}
+lock = threading.Lock()
+
+season_rank_sql = '''
+    --sql
+
+    SELECT
+        m.year,
+        r.name AS race,
+        r.date AS race_date,
+        t.type,
+        m.id,
+        CASE WHEN t.type = 'Driver' THEN d.full_name ELSE c.name END AS name,
+        COALESCE(c.name, 'No Constructor') AS constructor_name,
+        CASE WHEN t.type = 'Driver' THEN COALESCE(c.color, '#BAB0AC') ELSE c.color END AS constructor_color,
+        CASE WHEN t.type = 'Driver' THEN d.wiki_url ELSE c.wiki_url END AS wiki_url,
+        r.wiki_url AS race_wiki_url,
+        cir.wiki_url AS circuit_wiki_url,
+        s.wiki_url AS season_wiki_url,
+        mt.metric,
+        m.metric_value,
+        m.is_cumulative,
+        m.position
+    FROM
+        report_season_metrics AS m
+        INNER JOIN dim_metric AS mt
+            ON m.metric_k = mt.metric_k
+        INNER JOIN dim_type AS t
+            ON m.type_k = t.type_k
+        INNER JOIN dim_race AS r
+            ON m.race_k = r.race_k
+        LEFT JOIN dim_driver AS d
+            ON t.type = 'Driver'
+            AND m.id = d.driver_k
+        LEFT JOIN dim_constructor AS c
+            ON m.constructor_k = c.constructor_k
+        LEFT JOIN dim_circuit AS cir
+            ON r.circuit_k = cir.circuit_k
+        LEFT JOIN dim_season AS s
+            ON m.year = s.year
+    ORDER BY m.year, mt.metric, m.is_cumulative, r.date, t.type, m.position DESC;
+'''
+
+# the entities queries.py pads a season's top n with, as the rows they'd have,
+# and the seasons they're padded into
+entities_sql = '''
+    --sql
+
+    SELECT
+        'Driver' AS type,
+        driver_k AS id,
+        full_name AS name,
+        'No Constructor' AS constructor_name,
+        '#BAB0AC' AS constructor_color,
+        wiki_url
+    FROM dim_driver
+    UNION ALL
+    SELECT
+        'Constructor' AS type,
+        constructor_k AS id,
+        name,
+        name AS constructor_name,
+        color AS constructor_color,
+        wiki_url
+    FROM dim_constructor
+    ORDER BY type, id;
+'''
+
+padding_seasons_sql = '''
+    --sql
+
+    SELECT
+        year,
+        wiki_url AS season_wiki_url
+    FROM dim_season
+    WHERE year IN (SELECT year FROM dim_race)
+    ORDER BY year;
+'''
+
+seasons_rank_columns = [
+    'year',
+    'type',
+    'id',
+    'name',
+    'constructor_name',
+    'constructor_color',
+    'wiki_url',
+    'season_wiki_url',
+    'metric_value',
+    'position',
+]
+
+
+def load_columns(sql):
+    # text columns become codes into their sorted distinct values, so codes
+    # sort like the text. NULL is code -1, the last value, and sorts first
+    # like it does in sqlite
+    df = pd.read_sql(con=engine, sql=sql)
+    columns = {}
+
+    for name in df.columns:
+        if df[name].dtype == object:
+            codes, values = pd.factorize(df[name], sort=True)
+            columns[name] = (codes.astype(np.int32), np.append(values.to_numpy(dtype=object), None))
+        else:
+            columns[name] = df[name].to_numpy()
+
+    return columns, len(df)
+
+
+def codes(columns, name):
+    values = columns[name]
+    return values[0] if isinstance(values, tuple) else values
+
+
+def values(columns, name, rows):
+    values = columns[name]
+
+    if isinstance(values, tuple):
+        codes, distinct_values = values
+        return distinct_values[codes[rows]]
+
+    # read_sql types a column of only NULLs as objects, not floats
+    values = values[rows]
+    if values.dtype.kind == 'f' and len(values) and np.isnan(values).all():
+        return np.full(len(values), None, dtype=object)
+
+    return values
+
+
+def load():
+    # group indexes hold each group's rows in the order its query returns them
+    version = db_state['version']
+
+    seasons, _ = load_columns('SELECT * FROM report_seasons_metrics')
+    year = seasons['year']
+    type_codes = codes(seasons, 'type')
+    seasons_keys = season_keys(year, values(seasons, 'type', slice(None)), seasons['id'])
+    seasons_groups = {}
+    seasons_cumulative_groups = {}
+    seasons_entities = {}
+    for metric in pd.unique(values(seasons, 'metric', slice(None))):
+        rows = np.flatnonzero(values(seasons, 'metric', slice(None)) == metric)
+        seasons_groups[metric] = rows[np.lexsort((-seasons['position'][rows], type_codes[rows], year[rows]))]
+        seasons_cumulative_groups[metric] = rows[
+            np.lexsort((-seasons['cumulative_position'][rows], type_codes[rows], year[rows]))
+        ]
+        seasons_entities[metric] = seasons_keys[rows]
+
+    entities = pd.read_sql(con=engine, sql=entities_sql)
+    padding_seasons = pd.read_sql(con=engine, sql=padding_seasons_sql)
+
+    season, season_rows = load_columns(season_rank_sql)
+    keys = pd.DataFrame({
+        'year': season['year'],
+        'metric': values(season, 'metric', slice(None)),
+        'is_cumulative': season['is_cumulative'],
+    })
+    season_groups = {
+        key: np.asarray(rows)
+        for key, rows in keys.groupby(['year', 'metric', 'is_cumulative'], sort=False).indices.items()
+    }
+
+    race_positions = {}
+    with engine.connect() as con:
+        years = [
+            year
+            for (year,) in con.exec_driver_sql(
+                "SELECT year FROM etl_shard WHERE name = 'report_race_positions' ORDER BY year"
+            )
+        ]
+    for year in years:
+        with season_connection('report_race_positions', year) as con:
+            for race_year, race, *row in con.exec_driver_sql('''
+                SELECT r.year, r.name, p.laps, p.dtype, p.positions, p.drivers
+                FROM
+                    dim_race AS r
+                    INNER JOIN report_race_positions AS p
+                        ON r.race_k = p.race_k
+            '''):
+                race_positions.setdefault((race_year, race), tuple(row))
+
+    return {
+        'version': version,
+        'seasons': seasons,
+        'seasons_groups': seasons_groups,
+        'seasons_cumulative_groups': seasons_cumulative_groups,
+        'seasons_entities': seasons_entities,
+        'entities': entities,
+        'padding_seasons': padding_seasons,
+        'season': season,
+        'season_groups': season_groups,
+        'race_positions': race_positions,
+    }
+
+
+def current():
+    if data['version'] != db_state['version']:
+        with lock:
+            if data['version'] != db_state['version']:
+                data.update(load())
+
+    return data
+
+
+def frame(columns, rows, names):
+    # no rows come back from read_sql as untyped columns
+    if not len(rows):
+        return pd.DataFrame.from_records([], columns=[output_name for output_name, _ in names])
+
+    return pd.DataFrame({
+        output_name: values(columns, name, rows)
+        for output_name, name in names
+    })
+
+
+def season_keys(year, types, ids):
+    # a driver's or constructor's row in a season as one int
+    return (np.asarray(year, dtype=np.int64) * 2 + (np.asarray(types) == 'Driver')) * (1 << 32) + np.asarray(ids)
+
+
+def padded(loaded, metric, start_year, top_n, df, pad_value):
+    # df's rows with queries.py's padding: the first top_n entities by id of
+    # each type, with pad_value, in the seasons from start_year they have no
+    # row in. both are ranked per season and type by value, then id, NULL
+    # values last, and each season's top_n kept
+    entities = loaded['entities'].groupby('type', sort=False).head(top_n)
+    seasons = loaded['padding_seasons']
+    seasons = seasons[seasons['year'] >= start_year]
+
+    season_index = np.repeat(np.arange(len(seasons)), len(entities))
+    entity_index = np.tile(np.arange(len(entities)), len(seasons))
+    keys = season_keys(
+        seasons['year'].to_numpy()[season_index],
+        entities['type'].to_numpy()[entity_index],
+        entities['id'].to_numpy()[entity_index],
+    )
+    missing = ~np.isin(keys, loaded['seasons_entities'].get(metric, np.array([], dtype=np.int64)), assume_unique=True)
+
+    padding = entities.iloc[entity_index[missing]].reset_index(drop=True)
+    padding.insert(0, 'year', seasons['year'].to_numpy()[season_index[missing]])
+    padding['season_wiki_url'] = seasons['season_wiki_url'].to_numpy()[season_index[missing]]
+    padding['metric_value'] = pad_value
+
+    parts = [part for part in [df, padding] if len(part)]
+    if not parts:
+        return pd.DataFrame.from_records([], columns=seasons_rank_columns)
+    df = pd.concat(parts, ignore_index=True)
+
+    year = df['year'].to_numpy()
+    type_codes, _ = pd.factorize(df['type'], sort=True)
+    metric_values = df['metric_value'].to_numpy(dtype=float)
+    order = np.lexsort((df['id'].to_numpy(), np.where(np.isnan(metric_values), np.inf, -metric_values), type_codes, year))
+    year, type_codes = year[order], type_codes[order]
+
+    group_starts = np.flatnonzero(np.r_[True, (np.diff(year) != 0) | (np.diff(type_codes) != 0)])
+    positions = np.arange(len(order)) - np.repeat(group_starts, np.diff(np.r_[group_starts, len(order)])) + 1
+
+    kept = positions <= top_n
+    order, positions, year, type_codes = order[kept], positions[kept], year[kept], type_codes[kept]
+    output_order = np.lexsort((-positions, type_codes, year))
+
+    df = df.iloc[order[output_order]].reset_index(drop=True)
+    df['position'] = positions[output_order]
+
+    return df
+
+
+def first_season(metric):
+    loaded = current()
+    rows = loaded['seasons_groups'].get(metric, np.array([], dtype=np.int64))
+
+    return pd.DataFrame({'year': [loaded['seasons']['year'][rows].min() if len(rows) else None]})
+
+
+def seasons_rank(metric, start_year, top_n):
+    loaded = current()
+    seasons = loaded['seasons']
+    rows = loaded['seasons_groups'].get(metric, np.array([], dtype=np.int64))
+    rows = rows[(seasons['position'][rows] <= top_n) & (seasons['year'][rows] >= start_year)]
+
+    df = frame(seasons, rows, [(name, name) for name in seasons_rank_columns[:-1]])
+
+    return padded(loaded, metric, start_year, top_n, df, np.nan if metric == 'Points' else 0)
+
+
+def seasons_rank_cumulative(metric, start_year, top_n):
+    loaded = current()
+    seasons = loaded['seasons']
+    rows = loaded['seasons_cumulative_groups'].get(metric, np.array([], dtype=np.int64))
+    rows = rows[(seasons['cumulative_position'][rows] <= top_n) & (seasons['year'][rows] >= start_year)]
+
+    df = frame(seasons, rows, [
+        (name, {'metric_value': 'cumulative_metric_value'}.get(name, name))
+        for name in seasons_rank_columns[:-1]
+    ])
+
+    return padded(loaded, metric, start_year, top_n, df, 0)
+
+
+def seasons_rank_rebased(metric, start_year, top_n):
+    # running totals less each entity's total the season before start_year,
+    # re-ranked per season and type by the rebased total, then id
+    loaded = current()
+    seasons = loaded['seasons']
+    year = seasons['year']
+    type_codes = codes(seasons, 'type')
+    rows = loaded['seasons_groups'].get(metric, np.array([], dtype=np.int64))
+
+    def entity_keys(rows):
+        return type_codes[rows].astype(np.int64) * (1 << 32) + seasons['id'][rows]
+
+    base_rows = rows[year[rows] == start_year - 1]
+    base_rows = base_rows[np.argsort(entity_keys(base_rows))]
+    base_keys = entity_keys(base_rows)
+
+    rows = rows[year[rows] >= start_year]
+    keys = entity_keys(rows)
+    matches = np.minimum(np.searchsorted(base_keys, keys), max(len(base_keys) - 1, 0))
+    base_values = np.zeros(len(rows))
+    if len(base_keys):
+        matched = base_keys[matches] == keys
+        base_values[matched] = seasons['cumulative_metric_value'][base_rows[matches[matched]]]
+
+    df = frame(seasons, rows, [(name, name) for name in seasons_rank_columns[:-2]])
+    df['metric_value'] = seasons['cumulative_metric_value'][rows] - base_values
+
+    return padded(loaded, metric, start_year, top_n, df, 0)
+
+
+def season_rank(season, metric, is_cumulative, top_n):
+    loaded = current()
+    season_columns = loaded['season']
+    rows = loaded['season_groups'].get((season, metric, is_cumulative), np.array([], dtype=np.int64))
+    rows = rows[season_columns['position'][rows] <= top_n]
+
+    return frame(season_columns, rows, [(name, name) for name in season_columns])
+
+
+def race_positions(season, race):
+    return current()['race_positions'].get((season, race))
+
+
+# the named queries this engine answers, returning what queries.py's sql
+# path returns for them
+queries = {
+    'first_season': first_season,
+    'seasons_rank': seasons_rank,
+    'seasons_rank_cumulative': seasons_rank_cumulative,
+    'seasons_rank_rebased': seasons_rank_rebased,
+    'season_rank': season_rank,
+    'race_positions': race_positions,
+}
+
+if enabled:
+    current()
@@ -0,0 +1,389 @@
+from flask import jsonify
+from sqlalchemy import text
+import pandas as pd
+import threading
+import time
+
+from app import engine, season_connection, stats_route
+import memory_engine
+
+
+# report_seasons_metrics only has rows for the entities that raced in a
+# season or have a running total from earlier ones. the others rank below
+# them by id, with no points or a zero value, so each season's top n is padded
+# with them from the dims, as the rows they'd have: drivers without a
+# constructor. only the first top_n of each type by id can make it
+padding_sql = '''
+            entities AS (
+                SELECT *
+                FROM (
+                    SELECT
+                        'Driver' AS type,
+                        driver_k AS id,
+                        full_name AS name,
+                        'No Constructor' AS constructor_name,
+                        '#BAB0AC' AS constructor_color,
+                        wiki_url
+                    FROM dim_driver
+                    ORDER BY driver_k
+                    LIMIT :top_n
+                )
+                UNION ALL
+                SELECT *
+                FROM (
+                    SELECT
+                        'Constructor' AS type,
+                        constructor_k AS id,
+                        name,
+                        name AS constructor_name,
+                        color AS constructor_color,
+                        wiki_url
+                    FROM dim_constructor
+                    ORDER BY constructor_k
+                    LIMIT :top_n
+                )
+            ),
+            padding AS (
+                SELECT
+                    s.year,
+                    e.type,
+                    e.id,
+                    e.name,
+                    e.constructor_name,
+                    e.constructor_color,
+                    e.wiki_url,
+                    s.wiki_url AS season_wiki_url
+                FROM
+                    dim_season AS s
+                    CROSS JOIN entities AS e
+                WHERE TRUE
+                    AND s.year >= :start_year
+                    AND s.year IN (SELECT year FROM dim_race)
+                    AND NOT EXISTS (
+                        SELECT 1
+                        FROM report_seasons_metrics AS m
+                        WHERE TRUE
+                            AND m.metric = :metric
+                            AND m.year = s.year
+                            AND m.type = e.type
+                            AND m.id = e.id
+                    )
+            )'''
+
+# every query the app runs, by name. values are bound as parameters rather
+# than formatted into the sql, so a query's text is the same on every request
+# and sqlite reuses the statement it prepared for it on the pooled connection
+queries = {
+    'first_season': '''
+        --sql
+
+        SELECT MIN(year) AS year
+        FROM report_seasons_metrics
+        WHERE metric = :metric;
+    ''',
+    # the etl stores all-time running totals, so the total since start_year
+    # is the running total less its value the season before start_year.
+    # only the ranking of the rebased totals is left to do per request
+    'seasons_rank_rebased': f'''
+        --sql
+
+        WITH
+            {padding_sql},
+            base AS (
+                SELECT
+                    type,
+                    id,
+                    cumulative_metric_value
+                FROM report_seasons_metrics
+                WHERE TRUE
+                    AND year = :start_year - 1
+                    AND metric = :metric
+            ),
+            candidates AS (
+                SELECT
+                    m.year,
+                    m.type,
+                    m.id,
+                    m.name,
+                    m.constructor_name,
+                    m.constructor_color,
+                    m.wiki_url,
+                    m.season_wiki_url,
+                    m.cumulative_metric_value - COALESCE(b.cumulative_metric_value, 0) AS metric_value
+                FROM
+                    report_seasons_metrics AS m
+                    LEFT JOIN base AS b
+                        ON m.type = b.type
+                        AND m.id = b.id
+                WHERE TRUE
+                    AND m.year >= :start_year
+                    AND m.metric = :metric
+                UNION ALL
+                SELECT
+                    *,
+                    0 AS metric_value
+                FROM padding
+            ),
+            rankings AS (
+                SELECT
+                    *,
+                    ROW_NUMBER() OVER (PARTITION BY year, type ORDER BY metric_value DESC, id) AS position
+                FROM candidates
+            )
+        SELECT *
+        FROM rankings
+        WHERE position <= :top_n
+        ORDER BY year, type, position DESC;
+    ''',
+    # totals and rankings from the first season are stored as-is, so these
+    # are range reads of the top_n rows per season, padded and ranked again.
+    # the unary + keeps sqlite on the position index rather than the much
+    # wider year range
+    'seasons_rank': f'''
+        --sql
+
+        WITH
+            {padding_sql},
+            candidates AS (
+                SELECT
+                    year,
+                    type,
+                    id,
+                    name,
+                    constructor_name,
+                    constructor_color,
+                    wiki_url,
+                    season_wiki_url,
+                    metric_value
+                FROM report_seasons_metrics
+                WHERE TRUE
+                    AND metric = :metric
+                    AND position <= :top_n
+                    AND +year >= :start_year
+                UNION ALL
+                SELECT
+                    *,
+                    CASE WHEN :metric = 'Points' THEN NULL ELSE 0 END AS metric_value
+                FROM padding
+            ),
+            rankings AS (
+                SELECT
+                    *,
+                    ROW_NUMBER() OVER (PARTITION BY year, type ORDER BY metric_value DESC, id) AS position
+                FROM candidates
+            )
+        SELECT *
+        FROM rankings
+        WHERE position <= :top_n
+        ORDER BY year, type, position DESC;
+    ''',
+    'seasons_rank_cumulative': f'''
+        --sql
+
+        WITH
+            {padding_sql},
+            candidates AS (
+                SELECT
+                    year,
+                    type,
+                    id,
+                    name,
+                    constructor_name,
+                    constructor_color,
+                    wiki_url,
+                    season_wiki_url,
+                    cumulative_metric_value AS metric_value
+                FROM report_seasons_metrics
+                WHERE TRUE
+                    AND metric = :metric
+                    AND cumulative_position <= :top_n
+                    AND +year >= :start_year
+                UNION ALL
+                SELECT
+                    *,
+                    0 AS metric_value
+                FROM padding
+            ),
+            rankings AS (
+                SELECT
+                    *,
+                    ROW_NUMBER() OVER (PARTITION BY year, type ORDER BY metric_value DESC, id) AS position
+                FROM candidates
+            )
+        SELECT *
+        FROM rankings
+        WHERE position <= :top_n
+        ORDER BY year, type, position DESC;
+    ''',
+    'season_rank': '''
+        --sql
+
+        SELECT
+            m.year,
+            r.name AS race,
+            r.date AS race_date,
+            t.type,
+            m.id,
+            CASE WHEN t.type = 'Driver' THEN d.full_name ELSE c.name END AS name,
+            COALESCE(c.name, 'No Constructor') AS constructor_name,
+            CASE WHEN t.type = 'Driver' THEN COALESCE(c.color, '#BAB0AC') ELSE c.color END AS constructor_color,
+            CASE WHEN t.type = 'Driver' THEN d.wiki_url ELSE c.wiki_url END AS wiki_url,
+            r.wiki_url AS race_wiki_url,
+            cir.wiki_url AS circuit_wiki_url,
+            s.wiki_url AS season_wiki_url,
+            mt.metric,
+            m.metric_value,
+            m.is_cumulative,
+            m.position
+        FROM
+            report_season_metrics AS m
+            INNER JOIN dim_metric AS mt
+                ON m.metric_k = mt.metric_k
+            INNER JOIN dim_type AS t
+                ON m.type_k = t.type_k
+            INNER JOIN dim_race AS r
+                ON m.race_k = r.race_k
+            LEFT JOIN dim_driver AS d
+                ON t.type = 'Driver'
+                AND m.id = d.driver_k
+            LEFT JOIN dim_constructor AS c
+                ON m.constructor_k = c.constructor_k
+            LEFT JOIN dim_circuit AS cir
+                ON r.circuit_k = cir.circuit_k
+            LEFT JOIN dim_season AS s
+                ON m.year = s.year
+        WHERE TRUE
+            AND m.year = :season
+            AND mt.metric = :metric
+            AND m.is_cumulative = :is_cumulative
+            AND m.position <= :top_n
+        ORDER BY r.date, t.type, m.position DESC;
+    ''',
+    # reads the season's shard, see shard_tables
+    'race_positions': '''
+        --sql
+
+        SELECT
+            p.laps,
+            p.dtype,
+            p.positions,
+            p.drivers
+        FROM
+            dim_race AS r
+            INNER JOIN report_race_positions AS p
+                ON r.race_k = p.race_k
+        WHERE TRUE
+            AND r.year = :season
+            AND r.name = :race;
+    ''',
+    # figures the etl rendered into the database, see render_figures.py
+    'precomputed_figure': '''
+        --sql
+
+        SELECT json
+        FROM report_figure_cache
+        WHERE key = :key;
+    ''',
+    'metrics': '''
+        --sql
+
+        SELECT metric
+        FROM dim_metric;
+    ''',
+    'season_years': '''
+        --sql
+
+        SELECT MIN(year) AS first_year, MAX(year) AS last_year
+        FROM dim_race;
+    ''',
+    'season_races': '''
+        --sql
+
+        SELECT r.name
+        FROM
+            fact_race_result AS rr
+            LEFT JOIN dim_race AS r
+                ON rr.race_k = r.race_k
+        WHERE r.year = :season
+        GROUP BY name
+        ORDER BY MAX(date);
+    ''',
+    'race_drivers': '''
+        --sql
+
+        SELECT d.full_name
+        FROM
+            fact_race_result AS rr
+            LEFT JOIN dim_race AS r
+                ON rr.race_k = r.race_k
+            LEFT JOIN dim_driver AS d
+                ON rr.driver_k = d.driver_k
+        WHERE TRUE
+            AND NOT rr.is_sprint
+            AND r.year = :season
+            AND r.name = :race
+        GROUP BY d.full_name;
+    ''',
+}
+
+statements = {name: text(sql) for name, sql in queries.items()}
+
+# queries that read a per-season shard, attached for the season param
+shard_tables = {
+    'race_positions': 'report_race_positions',
+}
+
+# calls and time spent in each query since the worker started
+stats = {name: {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0} for name in queries}
+stats_lock = threading.Lock()
+
+
+def record(name, seconds):
+    with stats_lock:
+        stats[name]['calls'] += 1
+        stats[name]['seconds'] += seconds
+        stats[name]['max_seconds'] = max(stats[name]['max_seconds'], seconds)
+
+
+def read(name, con=None, **params):
+    # runs a named query and returns its rows as a DataFrame. queries the
+    # memory engine answers are read from it when it's turned on
+    start = time.perf_counter()
+
+    try:
+        if memory_engine.enabled and name in memory_engine.queries:
+            return memory_engine.queries[name](**params)
+
+        return pd.read_sql(con=con if con is not None else engine, sql=statements[name], params=params)
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def read_row(name, con=None, **params):
+    # runs a named query and returns its first row, or None
+    start = time.perf_counter()
+
+    try:
+        if memory_engine.enabled and name in memory_engine.queries:
+            return memory_engine.queries[name](**params)
+
+        if con is not None:
+            return con.execute(statements[name], params).fetchone()
+
+        if name in shard_tables:
+            with season_connection(shard_tables[name], params['season']) as con:
+                return con.execute(statements[name], params).fetchone()
+
+        with engine.connect() as con:
+            return con.execute(statements[name], params).fetchone()
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+@stats_route('/api/query_stats')
+def query_stats():
+    with stats_lock:
+        return jsonify({
+            name: dict(counters, mean_seconds=counters['seconds'] / counters['calls'] if counters['calls'] else None)
+            for name, counters in stats.items()
+        })
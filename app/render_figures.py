@@ -0,0 +1,109 @@
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import zlib
+
+
+# renders the figures most requests ask for into the report_figure_cache table
+# of a database, with the app's own chart code, so the app serves them from
+# there rather than building them. the etl runs it on each new database
+# before publishing it
+parser = argparse.ArgumentParser()
+parser.add_argument('db_path', help='database to render the figures from and into')
+parser.add_argument(
+    '--jobs', type=int, default=os.cpu_count(),
+    help='number of figures to render in parallel',
+)
+args = parser.parse_args()
+
+os.environ['F1_DB_PATH'] = os.path.abspath(args.db_path)
+
+from app import engine
+from apps.seasons import charts
+import figure_cache
+import queries
+
+# the seasons chart at these views, with the batches of frames the browser
+# fetches for them, the season chart for every season at these metrics and
+# top n, cumulative as the page opens it, and the bump chart of every race
+# with lap data, with no driver in focus
+seasons_views = [('Podiums', 'True', 1950, 10)]
+season_metrics = ['Points']
+season_top_n = [10]
+
+
+def views():
+    with engine.connect() as con:
+        seasons = [
+            year
+            for (year,) in con.exec_driver_sql('SELECT DISTINCT year FROM report_seasons_metrics ORDER BY year')
+        ]
+        race_seasons = [
+            year
+            for (year,) in con.exec_driver_sql('''
+                SELECT DISTINCT r.year
+                FROM
+                    fact_lap AS l
+                    INNER JOIN dim_race AS r
+                        ON l.race_k = r.race_k
+                ORDER BY r.year
+            ''')
+        ]
+
+    for view in seasons_views:
+        yield 'seasons_rank_chart', view
+
+        # a batch past the last frame is empty, so this can overshoot
+        start_year = view[2]
+        frames = len([season for season in seasons if season >= start_year])
+        for batch in range(-(-frames // charts.frame_batch_size)):
+            yield 'seasons_rank_frames', view + (batch,)
+
+    for season in seasons:
+        for metric in season_metrics:
+            for top_n in season_top_n:
+                yield 'season_rank_chart', (metric, 'True', season, top_n)
+
+    for season in race_seasons:
+        for race in queries.read('season_races', season=season)['name']:
+            yield 'race_bump_chart', (season, race, 'None')
+
+
+def render(view):
+    # the charts are called undecorated, so nothing goes to the caches
+    chart_name, chart_args = view
+    figure = getattr(charts, chart_name).__wrapped__(*chart_args)
+
+    # the json is stored compressed, at about a tenth of its size
+    return (
+        figure_cache.figure_key(chart_name, chart_args, {}),
+        chart_name,
+        zlib.compress(figure_cache.to_json(figure)),
+    )
+
+
+if __name__ == '__main__':
+    with multiprocessing.Pool(args.jobs) as pool:
+        rendered = pool.map(render, list(views()), chunksize=1)
+
+    # the app's connections open the database immutable, so they're closed
+    # before it's written to
+    engine.dispose()
+
+    con = sqlite3.connect(args.db_path)
+    try:
+        with con:
+            con.execute('DROP TABLE IF EXISTS report_figure_cache')
+            con.execute('''
+                CREATE TABLE report_figure_cache (
+                    key TEXT PRIMARY KEY,
+                    chart TEXT NOT NULL,
+                    json BLOB NOT NULL
+                )
+            ''')
+            con.executemany('INSERT OR REPLACE INTO report_figure_cache (key, chart, json) VALUES (?, ?, ?)', rendered)
+    finally:
+        con.close()
+
+    print(f'rendered {len(rendered)} figures')
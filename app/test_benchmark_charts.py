@@ -0,0 +1,14 @@
+import os
+
+import pytest
+
+from app import db_path
+import benchmark_charts
+
+
+# benchmark_charts.py --check over the same views. the figures are built from
+# the app's database, so these are skipped until the etl has built one
+@pytest.mark.skipif(not os.path.exists(db_path), reason='no database, run the etl first')
+@pytest.mark.parametrize('chart_name, chart_args', benchmark_charts.views)
+def test_plain_figure_matches_validated(chart_name, chart_args):
+    assert benchmark_charts.check(chart_name, chart_args) == []
@@ -0,0 +1,320 @@
+import os
+import sqlite3
+import time
+
+import scheduler
+import shards
+import staging
+
+
+# how each table is brought up to date when races are appended instead of
+# rebuilt. 'race' tables only read rows of the same race, and 'season' tables
+# only rows of the same season, so just those rows are rebuilt. 'running_total'
+# tables also carry totals over from earlier seasons, which are read from the
+# table itself. sharded tables are rebuilt a season at a time, as each
+# season's shard is rewritten whole
+partitions = {
+    'fact_lap': 'race',
+    'fact_pit_stop': 'race',
+    'fact_qualifying': 'race',
+    'fact_race_result': 'race',
+    'report_race_positions': 'season',
+    'report_season_metrics': 'season',
+    'report_seasons_metrics': 'running_total',
+}
+
+# stg tables that can hold rows of a race before it has results
+race_sources = ['stg_results', 'stg_sprint_results', 'stg_qualifying', 'stg_lap_times', 'stg_pit_stops']
+
+# the season's new rows are computed from its own races, then totals are added
+# to the previous season's and entities that sat the season out carry theirs over.
+# the step holds every appended season, so each is read on its own
+running_total_sql = {
+    'report_seasons_metrics': '''
+        --sql
+
+        INSERT INTO main.report_seasons_metrics
+            WITH
+                previous AS (
+                    SELECT *
+                    FROM main.report_seasons_metrics
+                    WHERE year = (
+                        SELECT MAX(year)
+                        FROM main.report_seasons_metrics
+                        WHERE year < {year}
+                    )
+                ),
+                season AS (
+                    SELECT
+                        s.year,
+                        s.type,
+                        s.id,
+                        s.name,
+                        s.constructor_name,
+                        s.constructor_color,
+                        s.wiki_url,
+                        s.season_wiki_url,
+                        s.metric,
+                        s.metric_value,
+                        COALESCE(p.cumulative_metric_value, 0) + COALESCE(s.metric_value, 0) AS cumulative_metric_value
+                    FROM
+                        step.report_seasons_metrics AS s
+                        LEFT JOIN previous AS p
+                            ON s.type = p.type
+                            AND s.id = p.id
+                            AND s.metric = p.metric
+                    WHERE s.year = {year}
+                    UNION ALL
+                    SELECT
+                        {year} AS year,
+                        p.type,
+                        p.id,
+                        p.name,
+                        CASE WHEN p.type = 'Driver' THEN 'No Constructor' ELSE p.constructor_name END AS constructor_name,
+                        CASE WHEN p.type = 'Driver' THEN '#BAB0AC' ELSE p.constructor_color END AS constructor_color,
+                        p.wiki_url,
+                        (SELECT wiki_url FROM main.dim_season WHERE year = {year}) AS season_wiki_url,
+                        p.metric,
+                        CASE WHEN p.metric = 'Points' THEN NULL ELSE 0 END AS metric_value,
+                        p.cumulative_metric_value
+                    FROM previous AS p
+                    WHERE TRUE
+                        AND p.cumulative_metric_value <> 0
+                        AND NOT EXISTS (
+                            SELECT 1
+                            FROM step.report_seasons_metrics AS s
+                            WHERE TRUE
+                                AND s.year = {year}
+                                AND s.type = p.type
+                                AND s.id = p.id
+                                AND s.metric = p.metric
+                        )
+                )
+            SELECT
+                year,
+                type,
+                id,
+                name,
+                constructor_name,
+                constructor_color,
+                wiki_url,
+                season_wiki_url,
+                metric,
+                metric_value,
+                ROW_NUMBER() OVER (PARTITION BY year, type, metric ORDER BY metric_value DESC, id) AS position,
+                cumulative_metric_value,
+                ROW_NUMBER() OVER (PARTITION BY year, type, metric ORDER BY cumulative_metric_value DESC, id) AS cumulative_position
+            FROM season
+            ORDER BY year, metric, type, position DESC;
+    ''',
+}
+
+
+def new_races(db_path):
+    # races with rows in the staged csvs but no results in the warehouse yet,
+    # and the seasons they belong to. returns None if there are none, or if
+    # any is in an earlier season than races that already have results, as
+    # the running totals of the seasons after it would need rebuilding too
+    con = sqlite3.connect(db_path)
+    try:
+        tables = {name for (name,) in con.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+        race_ks = sorted({
+            race_k
+            for table_name in race_sources
+            if table_name in tables
+            for (race_k,) in con.execute(f'''
+                SELECT DISTINCT raceId
+                FROM {table_name}
+                WHERE raceId NOT IN (SELECT race_k FROM fact_race_result)
+            ''')
+        })
+
+        if not race_ks:
+            return None
+
+        years = [
+            year
+            for (year,) in con.execute(f'''
+                SELECT DISTINCT year
+                FROM dim_race
+                WHERE race_k IN ({", ".join(map(str, race_ks))})
+                ORDER BY year
+            ''')
+        ]
+        latest_year = con.execute('''
+            SELECT MAX(r.year)
+            FROM
+                fact_race_result AS rr
+                INNER JOIN dim_race AS r
+                    ON rr.race_k = r.race_k
+        ''').fetchone()[0]
+    finally:
+        con.close()
+
+    if not years or (latest_year is not None and years[0] < latest_year):
+        return None
+
+    return race_ks, years
+
+
+def copy_inputs(db_path, step, race_ks, inputs_path):
+    # copies the rows of the given races from every table the step reads that
+    # is keyed by race. other tables are read from the warehouse as they are
+    if os.path.exists(inputs_path):
+        os.remove(inputs_path)
+
+    con = sqlite3.connect(inputs_path, isolation_level=None)
+    try:
+        staging.set_build_pragmas(con, None)
+        con.execute('ATTACH DATABASE ? AS warehouse', (db_path,))
+
+        for dependency in step['depends_on']:
+            columns = {column for _, column, *_ in con.execute(f'PRAGMA warehouse.table_info("{dependency}")')}
+            key = next((key for key in ['race_k', 'raceId'] if key in columns), None)
+
+            if key is not None:
+                con.execute(f'''
+                    CREATE TABLE main.{dependency} AS
+                    SELECT *
+                    FROM warehouse.{dependency}
+                    WHERE {key} IN ({", ".join(map(str, race_ks))})
+                ''')
+    finally:
+        con.close()
+
+
+def run(steps, db_path, build_dir, race_ks, years):
+    # rebuilds each step's rows for the appended races and swaps them into its
+    # table, in step order. returns each step's timing and row count
+    os.makedirs(build_dir, exist_ok=True)
+
+    inputs_path = os.path.join(build_dir, 'append_inputs.db')
+    step_stats = {}
+    start = time.perf_counter()
+
+    con = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        staging.set_build_pragmas(con, None)
+
+        season_race_ks = [
+            race_k
+            for (race_k,) in con.execute(f'''
+                SELECT race_k
+                FROM dim_race
+                WHERE year IN ({", ".join(map(str, years))})
+            ''')
+        ]
+
+        for step in steps:
+            step_start = time.perf_counter()
+            partition = partitions[step['name']]
+            partition_race_ks = race_ks if partition == 'race' else season_race_ks
+            path = scheduler.step_path(build_dir, step['name'])
+
+            copy_inputs(db_path, step, partition_race_ks, inputs_path)
+            stats = scheduler.build_step(step, db_path, {'append_inputs': inputs_path}, path)
+
+            if step.get('shard'):
+                shards.write(db_path, path, step['name'])
+            else:
+                con.execute('ATTACH DATABASE ? AS step', (path,))
+                con.execute('BEGIN')
+
+                if partition == 'running_total':
+                    for year in years:
+                        con.execute(f'DELETE FROM main.{step["name"]} WHERE year = {year}')
+                        con.execute(running_total_sql[step['name']].format(year=year))
+                else:
+                    con.execute(f'''
+                        DELETE FROM main.{step["name"]}
+                        WHERE race_k IN ({", ".join(map(str, partition_race_ks))})
+                    ''')
+                    con.execute(f'INSERT INTO main.{step["name"]} SELECT * FROM step.{step["name"]}')
+
+                con.execute('COMMIT')
+                con.execute('DETACH DATABASE step')
+
+            os.remove(path)
+
+            stats['seconds'] = time.perf_counter() - step_start
+            stats['finished'] = time.perf_counter() - start
+            step_stats[step['name']] = stats
+            print(
+                f'{step["name"]}: appended {stats["rows"]:,} rows in {stats["seconds"]:.2f}s '
+                f'({stats["finished"]:.2f}s elapsed)'
+            )
+    finally:
+        con.close()
+
+    os.remove(inputs_path)
+
+    return step_stats
+
+
+def compare(con, appended, rebuilt):
+    # row counts of both tables and of the rows found in only one of them
+    return con.execute(f'''
+        SELECT
+            (SELECT COUNT(*) FROM {appended}),
+            (SELECT COUNT(*) FROM {rebuilt}),
+            (SELECT COUNT(*) FROM (SELECT * FROM {appended} EXCEPT SELECT * FROM {rebuilt})),
+            (SELECT COUNT(*) FROM (SELECT * FROM {rebuilt} EXCEPT SELECT * FROM {appended}))
+    ''').fetchone()
+
+
+def verify(steps, db_path, build_dir):
+    # rebuilds the appended tables from scratch and returns the ones whose
+    # contents differ from the appended ones
+    os.makedirs(build_dir, exist_ok=True)
+
+    mismatches = []
+
+    con = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        for step in steps:
+            path = scheduler.step_path(build_dir, f'verify_{step["name"]}')
+            scheduler.build_step(step, db_path, {}, path)
+
+            con.execute('ATTACH DATABASE ? AS rebuilt', (path,))
+
+            if step.get('shard'):
+                # each season's shard is compared with that season's rebuilt rows
+                appended_rows, only_appended, only_rebuilt = 0, 0, 0
+                for year, shard_path in shards.paths(con, step['name']).items():
+                    con.execute('ATTACH DATABASE ? AS shard', (shard_path,))
+                    counts = compare(
+                        con,
+                        f'shard.{step["name"]}',
+                        f'''(
+                            SELECT *
+                            FROM rebuilt.{step["name"]}
+                            WHERE race_k IN (SELECT race_k FROM main.dim_race WHERE year = {year})
+                        )''',
+                    )
+                    con.execute('DETACH DATABASE shard')
+
+                    appended_rows += counts[0]
+                    only_appended += counts[2]
+                    only_rebuilt += counts[3]
+
+                rebuilt_rows = con.execute(f'SELECT COUNT(*) FROM rebuilt.{step["name"]}').fetchone()[0]
+            else:
+                appended_rows, rebuilt_rows, only_appended, only_rebuilt = compare(
+                    con, f'main.{step["name"]}', f'rebuilt.{step["name"]}',
+                )
+
+            con.execute('DETACH DATABASE rebuilt')
+            os.remove(path)
+
+            if appended_rows != rebuilt_rows or only_appended or only_rebuilt:
+                mismatches.append(step['name'])
+
+            print(
+                f'{step["name"]}: {appended_rows:,} appended vs {rebuilt_rows:,} rebuilt rows, '
+                f'{only_appended:,}/{only_rebuilt:,} rows only in one'
+            )
+    finally:
+        con.close()
+
+    return mismatches
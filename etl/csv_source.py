@@ -0,0 +1,60 @@
+import contextlib
+import io
+import os
+import zipfile
+
+import manifest
+
+
+# a source is an (archive, name) pair: name is a member of the zip archive, or
+# a plain file path when archive is None. csvs are read straight out of the
+# archive, so the dataset never has to be extracted to disk
+
+
+def find(locations):
+    # maps each staging table to its csv across zip archives and directories.
+    # later locations win, so the downloaded archive takes precedence over any
+    # csvs extracted next to it by older runs
+    sources = {}
+
+    for location in locations:
+        if os.path.isdir(location):
+            for filename in sorted(os.listdir(location)):
+                if filename.endswith('.csv'):
+                    sources['stg_' + filename[:-4]] = (None, os.path.join(location, filename))
+        elif zipfile.is_zipfile(location):
+            with zipfile.ZipFile(location) as archive:
+                for name in archive.namelist():
+                    if name.endswith('.csv'):
+                        sources['stg_' + os.path.basename(name)[:-4]] = (location, name)
+
+    return sources
+
+
+def signature(source):
+    # zip members are identified by the crc and size in the archive's
+    # directory, which changes with their contents and costs nothing to read
+    archive_path, name = source
+
+    if archive_path is None:
+        return manifest.file_hash(name)
+
+    with zipfile.ZipFile(archive_path) as archive:
+        info = archive.getinfo(name)
+
+    return f'zip:{info.CRC:08x}:{info.file_size}'
+
+
+@contextlib.contextmanager
+def open_text(source):
+    # yields the csv as a text stream that is decompressed as it is read
+    archive_path, name = source
+
+    if archive_path is None:
+        with open(name, newline='', encoding='utf-8') as file:
+            yield file
+        return
+
+    with zipfile.ZipFile(archive_path) as archive:
+        with archive.open(name) as member:
+            yield io.TextIOWrapper(member, newline='', encoding='utf-8')
@@ -0,0 +1,217 @@
+import os
+import sqlite3
+import time
+
+import duckdb
+import pandas as pd
+
+import packing
+import run_report
+import scheduler
+import staging
+
+
+# duckdb types the step sql produces, as sqlite column types. decimals come
+# from literals like 0.5 and are written as reals
+sqlite_types = {
+    'BOOLEAN': 'INTEGER',
+    'TINYINT': 'INTEGER',
+    'SMALLINT': 'INTEGER',
+    'INTEGER': 'INTEGER',
+    'BIGINT': 'INTEGER',
+    'HUGEINT': 'INTEGER',
+    'FLOAT': 'REAL',
+    'DOUBLE': 'REAL',
+    'DECIMAL': 'REAL',
+    'VARCHAR': 'TEXT',
+    'BLOB': 'BLOB',
+}
+
+
+def duckdb_type(sqlite_type):
+    # sqlite's own affinity rules, with untyped columns read in as text
+    sqlite_type = sqlite_type.upper()
+
+    if 'INT' in sqlite_type:
+        return 'BIGINT'
+    if any(name in sqlite_type for name in ['REAL', 'FLOA', 'DOUB']):
+        return 'DOUBLE'
+
+    return 'VARCHAR'
+
+
+def load_table(con, sqlite_con, name):
+    # copies a staging or warehouse table into duckdb with its declared types,
+    # so nullable integer columns don't come through pandas as floats
+    columns = [
+        (column, duckdb_type(declared_type))
+        for _, column, declared_type, *_ in sqlite_con.execute(f'PRAGMA table_info("{name}")')
+    ]
+
+    df = pd.read_sql(
+        con=sqlite_con,
+        sql='SELECT '
+        + ', '.join(
+            f'CAST("{column}" AS TEXT)' if column_type == 'VARCHAR' else f'"{column}"'
+            for column, column_type in columns
+        )
+        + f' FROM "{name}"',
+    )
+
+    con.execute(
+        f'CREATE TABLE "{name}" ('
+        + ', '.join(f'"{column}" {column_type}' for column, column_type in columns)
+        + ')'
+    )
+    con.register('df', df)
+    con.execute(f'INSERT INTO "{name}" SELECT * FROM df')
+    con.unregister('df')
+
+
+def fetch_rows(result, batch_size=100000):
+    rows = result.fetchmany(batch_size)
+    while rows:
+        yield from rows
+        rows = result.fetchmany(batch_size)
+
+
+def write_step(con, step, output_path, batch_size=100000):
+    # writes a table built in duckdb to its own sqlite file, the same way
+    # scheduler.build_step does, so scheduler.merge can copy it into place
+    if os.path.exists(output_path):
+        os.remove(output_path)
+
+    columns = con.execute(f'DESCRIBE "{step["name"]}"').fetchall()
+    column_types = [
+        sqlite_types.get(column_type.split('(')[0], 'TEXT')
+        for _, column_type, *_ in columns
+    ]
+
+    sqlite_con = sqlite3.connect(output_path, isolation_level=None)
+    try:
+        staging.set_build_pragmas(sqlite_con, None)
+
+        sqlite_con.execute('BEGIN')
+
+        if step['schema']:
+            sqlite_con.execute(step['schema'])
+        else:
+            sqlite_con.execute(
+                f'CREATE TABLE {step["name"]} ('
+                + ', '.join(
+                    f'"{column}" {column_type}'
+                    for (column, *_), column_type in zip(columns, column_types)
+                )
+                + ')'
+            )
+
+        result = con.execute(
+            'SELECT '
+            + ', '.join(
+                f'CAST("{column}" AS DOUBLE)' if column_type == 'REAL' else f'"{column}"'
+                for (column, *_), column_type in zip(columns, column_types)
+            )
+            + f' FROM "{step["name"]}"'
+        )
+        insert = (
+            f'INSERT INTO {step["name"]} VALUES ('
+            + ', '.join(['?'] * len(columns))
+            + ')'
+        )
+        rows = result.fetchmany(batch_size)
+        while rows:
+            sqlite_con.executemany(insert, rows)
+            rows = result.fetchmany(batch_size)
+
+        for index in step['indexes']:
+            sqlite_con.execute(index)
+
+        sqlite_con.execute('COMMIT')
+        sqlite_con.execute('ANALYZE main')
+    finally:
+        sqlite_con.close()
+
+
+def run(steps, db_path, build_dir, max_workers=None):
+    # builds the given steps in an in-memory duckdb database, which runs each
+    # statement across max_workers threads, then writes the finished tables
+    # into the sqlite database. the tables the steps read are copied in from
+    # the sqlite database first. returns the same stats as scheduler.run
+    os.makedirs(build_dir, exist_ok=True)
+
+    step_names = {step['name'] for step in steps}
+    step_stats = {}
+    start = time.perf_counter()
+
+    con = duckdb.connect()
+    sqlite_con = sqlite3.connect(db_path)
+    try:
+        if max_workers:
+            con.execute(f'SET threads = {max_workers}')
+
+        inputs = sorted({
+            dependency
+            for step in steps
+            for dependency in step['depends_on']
+            if dependency not in step_names
+        })
+        for name in inputs:
+            load_table(con, sqlite_con, name)
+
+        print(f'copied {len(inputs)} tables into duckdb in {time.perf_counter() - start:.2f}s')
+
+        for step in steps:
+            run_report.reset_peak_rss()
+            step_start = time.perf_counter()
+
+            # sqlite-only table options are left out of the duckdb copy; the
+            # sqlite file gets the schema as written
+            if step['schema']:
+                con.execute(step['schema'].replace('WITHOUT ROWID', ''))
+
+            query_plan = [
+                line
+                for _, plan in con.execute(f'EXPLAIN {step["sql"]}').fetchall()
+                for line in plan.splitlines()
+            ]
+
+            if step['name'] in packing.packers:
+                # the packed rows are few, so they're collected before inserting
+                packed_rows = list(packing.packers[step['name']](fetch_rows(con.execute(step['sql']))))
+                if packed_rows:
+                    con.executemany(
+                        f'INSERT INTO "{step["name"]}" VALUES ('
+                        + ', '.join(['?'] * len(packed_rows[0]))
+                        + ')',
+                        packed_rows,
+                    )
+            else:
+                con.execute(step['sql'])
+            write_start = time.perf_counter()
+
+            write_step(con, step, scheduler.step_path(build_dir, step['name']))
+
+            step_stats[step['name']] = {
+                'seconds': time.perf_counter() - step_start,
+                'write_seconds': time.perf_counter() - write_start,
+                'rows': con.execute(f'SELECT COUNT(*) FROM "{step["name"]}"').fetchone()[0],
+                'bytes': os.path.getsize(scheduler.step_path(build_dir, step['name'])),
+                'peak_rss_mb': run_report.peak_rss_mb(),
+                'query_plan': query_plan,
+                'finished': time.perf_counter() - start,
+            }
+            print(
+                f'{step["name"]}: {step_stats[step["name"]]["rows"]:,} rows in {step_stats[step["name"]]["seconds"]:.2f}s '
+                f'({step_stats[step["name"]]["finished"]:.2f}s elapsed)'
+            )
+    finally:
+        sqlite_con.close()
+        con.close()
+
+    merge_start = time.perf_counter()
+    scheduler.merge(db_path, steps, build_dir)
+    merge_seconds = time.perf_counter() - merge_start
+
+    print(f'built {len(steps)} tables in {time.perf_counter() - start:.2f}s')
+
+    return step_stats, merge_seconds
@@ -0,0 +1,88 @@
+import hashlib
+import inspect
+
+import pandas as pd
+
+import packing
+import staging
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def signatures(steps, source_hashes):
+    # a step's signature covers its own sql (and packer) and the signatures of
+    # everything it reads, so a changed csv invalidates every table downstream of it.
+    # a csv's covers the strings it's staged with as NULL too
+    signatures = {
+        table_name: hashlib.sha256((source_hash + repr(staging.na_values)).encode()).hexdigest()
+        for table_name, source_hash in source_hashes.items()
+    }
+
+    for step in steps:
+        digest = hashlib.sha256((step['schema'] or '').encode())
+        digest.update(step['sql'].encode())
+
+        for index in step['indexes']:
+            digest.update(index.encode())
+
+        digest.update((step.get('shard') or '').encode())
+
+        if step['name'] in packing.packers:
+            digest.update(inspect.getsource(packing.packers[step['name']]).encode())
+
+        for dependency in step['depends_on']:
+            digest.update(dependency.encode())
+            digest.update(signatures.get(dependency, '').encode())
+
+        signatures[step['name']] = digest.hexdigest()
+
+    return signatures
+
+
+def read(engine):
+    with engine.connect() as con:
+        exists = con.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'etl_manifest'"
+        ).fetchone()
+
+        if exists is None:
+            return {}
+
+        return dict(con.execute('SELECT name, signature FROM etl_manifest').fetchall())
+
+
+def existing_tables(engine):
+    # sharded tables live in their own files, listed in etl_shard
+    tables = set(pd.read_sql(
+        con=engine,
+        sql="SELECT name FROM sqlite_master WHERE type = 'table'"
+    )['name'])
+
+    if 'etl_shard' in tables:
+        tables |= set(pd.read_sql(con=engine, sql='SELECT DISTINCT name FROM etl_shard')['name'])
+
+    return tables
+
+
+def write(engine, signatures):
+    with engine.connect() as con:
+        con.execute('''
+            CREATE TABLE IF NOT EXISTS etl_manifest (
+                name TEXT PRIMARY KEY,
+                signature TEXT NOT NULL
+            )
+        ''')
+
+        for name, signature in signatures.items():
+            con.execute(
+                'INSERT OR REPLACE INTO etl_manifest (name, signature) VALUES (?, ?)',
+                (name, signature),
+            )
@@ -0,0 +1,57 @@
+import itertools
+import json
+import operator
+
+import numpy as np
+
+
+# steps listed here select rows with their 'sql' and have them turned into the
+# table's rows in python, for tables that sql can't build, like numpy arrays
+# packed into blobs. a packer takes an iterable of the selected rows and
+# yields the rows to insert, in the table's column order
+
+
+def race_positions(rows):
+    # one row per race: a drivers x laps matrix of positions, 0 where a driver
+    # has no lap, as the smallest int type that holds them, and a json list
+    # of each driver's name, code, constructor, colour and ending status, in
+    # the order the bump chart draws them. rows come ordered by race, then in
+    # drawing order, then by lap
+    for race_k, race_rows in itertools.groupby(rows, key=operator.itemgetter(0)):
+        drivers = {}
+
+        for _, driver_k, driver_name, driver_code, constructor_name, constructor_color, ending_status, lap, position in race_rows:
+            driver = drivers.setdefault(driver_k, {
+                'metadata': [driver_name, driver_code, constructor_name, constructor_color, None],
+                'positions': {},
+            })
+
+            if ending_status is not None:
+                driver['metadata'][4] = ending_status
+            if position is not None:
+                driver['positions'][lap] = position
+
+        # like a race without laps, a race without lap positions has no row
+        if not any(driver['positions'] for driver in drivers.values()):
+            continue
+
+        laps = max(lap for driver in drivers.values() for lap in driver['positions']) + 1
+        max_position = max(position for driver in drivers.values() for position in driver['positions'].values())
+        dtype = np.int8 if max_position <= np.iinfo(np.int8).max else np.int16
+
+        positions = np.zeros((len(drivers), laps), dtype=dtype)
+        for i, driver in enumerate(drivers.values()):
+            positions[i, list(driver['positions'])] = list(driver['positions'].values())
+
+        yield (
+            race_k,
+            laps,
+            positions.dtype.str,
+            positions.tobytes(),
+            json.dumps([driver['metadata'] for driver in drivers.values()]),
+        )
+
+
+packers = {
+    'report_race_positions': race_positions,
+}
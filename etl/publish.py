@@ -0,0 +1,37 @@
+import glob
+import os
+import sqlite3
+import time
+
+
+def shadow_copy(db_path):
+    # starts a new build from a consistent copy of the live database, so tables
+    # that aren't stale carry over. the copy is versioned by build time, and
+    # shadows left behind by failed runs are removed first
+    for old_shadow_path in glob.glob(f'{db_path}.*.shadow'):
+        os.remove(old_shadow_path)
+
+    shadow_path = f'{db_path}.{time.strftime("%Y%m%d%H%M%S")}.shadow'
+
+    shadow = sqlite3.connect(shadow_path)
+    try:
+        if os.path.exists(db_path):
+            live = sqlite3.connect(db_path)
+            try:
+                live.backup(shadow)
+            finally:
+                live.close()
+    finally:
+        shadow.close()
+
+    return shadow_path
+
+
+def swap(shadow_path, db_path):
+    # the rename is atomic, so readers see either the old database or the new
+    # one. connections already open on the old file keep reading it until the
+    # app notices the new version and recycles them
+    with open(shadow_path, 'rb') as shadow:
+        os.fsync(shadow.fileno())
+
+    os.replace(shadow_path, db_path)
@@ -0,0 +1,147 @@
+import argparse
+import json
+import os
+import sys
+
+import psutil
+
+
+def reset_peak_rss():
+    # on linux the high-water mark can be reset, which makes the peak
+    # per-step even though pool workers are reused between steps
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    memory_info = psutil.Process().memory_info()
+    return getattr(memory_info, 'peak_wset', memory_info.rss) / (1024 * 1024)
+
+
+def query_plan(con, sql):
+    # formats EXPLAIN QUERY PLAN rows as an indented tree, like the sqlite shell
+    rows = con.execute(f'EXPLAIN QUERY PLAN {sql}').fetchall()
+    depths = {0: -1}
+    plan = []
+
+    for node, parent, _, detail in rows:
+        depths[node] = depths.get(parent, -1) + 1
+        plan.append('  ' * depths[node] + detail)
+
+    return plan
+
+
+def critical_path(steps, step_stats):
+    # the chain of dependent steps with the largest total build time, which
+    # bounds the wall time of a parallel build
+    longest = {}
+
+    for step in steps:
+        upstream = max(
+            (longest[dependency] for dependency in step['depends_on'] if dependency in longest),
+            key=lambda path: path[0],
+            default=(0, []),
+        )
+        longest[step['name']] = (
+            upstream[0] + step_stats[step['name']]['seconds'],
+            upstream[1] + [step['name']],
+        )
+
+    seconds, path = max(longest.values(), key=lambda path: path[0], default=(0, []))
+
+    return {'seconds': seconds, 'steps': path}
+
+
+def write(path, report):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, 'w') as file:
+        json.dump(report, file, indent=2)
+
+
+def read(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def size_mb(step_stats):
+    if 'bytes' not in step_stats:
+        return '?'
+
+    return f'{step_stats["bytes"] / (1024 * 1024):.1f}MB'
+
+
+def compare(old, new, threshold=1.25, min_seconds=0.5):
+    # returns a line per step, flagging steps that got slower or hungrier by
+    # more than the threshold, changed row count or changed query plan.
+    # reports written before sizes were recorded show their size as unknown
+    regressions = []
+    lines = []
+
+    for name, new_stats in new['steps'].items():
+        old_stats = old['steps'].get(name)
+
+        if old_stats is None:
+            lines.append(f'{name}: new step, {new_stats["seconds"]:.2f}s')
+            continue
+
+        flags = []
+
+        if (
+            new_stats['seconds'] > old_stats['seconds'] * threshold
+            and new_stats['seconds'] - old_stats['seconds'] > min_seconds
+        ):
+            flags.append('slower')
+
+        if new_stats['peak_rss_mb'] > old_stats['peak_rss_mb'] * threshold:
+            flags.append('more memory')
+
+        if new_stats['rows'] != old_stats['rows']:
+            flags.append('row count changed')
+
+        if new_stats['query_plan'] != old_stats['query_plan']:
+            flags.append('query plan changed')
+
+        if {'slower', 'more memory'} & set(flags):
+            regressions.append(name)
+
+        lines.append(
+            f'{name}: '
+            f'{old_stats["seconds"]:.2f}s -> {new_stats["seconds"]:.2f}s, '
+            f'{old_stats["peak_rss_mb"]:.0f}MB -> {new_stats["peak_rss_mb"]:.0f}MB, '
+            f'{old_stats["rows"]:,} -> {new_stats["rows"]:,} rows, '
+            f'{size_mb(old_stats)} -> {size_mb(new_stats)} on disk'
+            + (f' [{", ".join(flags)}]' if flags else '')
+        )
+
+    return lines, regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='compare two etl run reports')
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument(
+        '--threshold', type=float, default=1.25,
+        help='ratio of new to old time/memory that counts as a regression',
+    )
+    args = parser.parse_args()
+
+    lines, regressions = compare(read(args.old), read(args.new), args.threshold)
+
+    print('\n'.join(lines))
+
+    if regressions:
+        print(f'regressed: {", ".join(regressions)}')
+        sys.exit(1)
@@ -0,0 +1,186 @@
+import concurrent.futures
+import multiprocessing
+import os
+import sqlite3
+import time
+
+import packing
+import run_report
+import shards
+import staging
+
+
+def step_path(build_dir, name):
+    return os.path.join(build_dir, f'{name}.db')
+
+
+def insert(con, name, rows):
+    # inserts rows produced in python into a table in one transaction
+    columns = con.execute(f'PRAGMA main.table_info("{name}")').fetchall()
+
+    con.execute('BEGIN')
+    con.executemany(
+        f'INSERT INTO main.{name} VALUES ({", ".join(["?"] * len(columns))})',
+        rows,
+    )
+    con.execute('COMMIT')
+
+
+def build_step(step, db_path, dependency_paths, output_path):
+    # builds one table into its own database file. tables rebuilt earlier in
+    # this run are attached ahead of the main database, so unqualified names in
+    # the step's sql resolve to the fresh copies (sqlite picks the earliest
+    # attached match) and everything else falls through to the main database
+    run_report.reset_peak_rss()
+    start = time.perf_counter()
+
+    if os.path.exists(output_path):
+        os.remove(output_path)
+
+    con = sqlite3.connect(output_path, isolation_level=None)
+    try:
+        staging.set_build_pragmas(con, None)
+
+        for dependency, path in dependency_paths.items():
+            con.execute(f'ATTACH DATABASE ? AS step_{dependency}', (path,))
+        con.execute('ATTACH DATABASE ? AS warehouse', (db_path,))
+
+        if step['schema']:
+            con.execute(step['schema'])
+
+        query_plan = run_report.query_plan(con, step['sql'])
+
+        if step['name'] in packing.packers:
+            insert(con, step['name'], packing.packers[step['name']](con.execute(step['sql'])))
+        else:
+            con.execute(step['sql'])
+
+        for index in step['indexes']:
+            con.execute(index)
+
+        # gives the planner statistics for the steps that read this table
+        con.execute('ANALYZE main')
+
+        rows = con.execute(f'SELECT COUNT(*) FROM main.{step["name"]}').fetchone()[0]
+    finally:
+        con.close()
+
+    return {
+        'seconds': time.perf_counter() - start,
+        'rows': rows,
+        # the step's file holds just its table and indexes
+        'bytes': os.path.getsize(output_path),
+        'peak_rss_mb': run_report.peak_rss_mb(),
+        'query_plan': query_plan,
+    }
+
+
+def merge(db_path, steps, build_dir):
+    # copies each built table, with its declared schema and indexes, over the
+    # old one in the main database. sharded tables are split into their
+    # per-season databases instead
+    con = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        staging.set_build_pragmas(con, None)
+
+        for step in steps:
+            path = step_path(build_dir, step['name'])
+
+            if step.get('shard'):
+                shards.write(db_path, path, step['name'])
+                os.remove(path)
+                continue
+
+            con.execute('ATTACH DATABASE ? AS step', (path,))
+
+            schema = con.execute(
+                '''
+                    SELECT type, sql
+                    FROM step.sqlite_master
+                    WHERE tbl_name = ? AND sql IS NOT NULL
+                    ORDER BY type = 'index'
+                ''',
+                (step['name'],)
+            ).fetchall()
+
+            con.execute('BEGIN')
+            con.execute(f'DROP TABLE IF EXISTS main.{step["name"]}')
+            for type, sql in schema:
+                con.execute(sql)
+                if type == 'table':
+                    con.execute(f'INSERT INTO main.{step["name"]} SELECT * FROM step.{step["name"]}')
+            con.execute('COMMIT')
+
+            con.execute('DETACH DATABASE step')
+            os.remove(path)
+    finally:
+        con.close()
+
+
+def pool_executor(max_workers):
+    # forked workers share nothing with the parent but the step definitions.
+    # where fork isn't available, spawned workers would re-run the etl script
+    # on import, so fall back to threads (sqlite releases the gil while a
+    # statement runs, so these still overlap)
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context('fork'),
+        )
+
+    return concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+
+def run(steps, db_path, build_dir, max_workers=None):
+    # builds the given steps as a dependency graph: a step is submitted as soon
+    # as every step it depends on has finished, so the total wall time is the
+    # critical path rather than the sum of all steps. returns each step's
+    # timing, row count, size on disk, peak memory and query plan
+    os.makedirs(build_dir, exist_ok=True)
+
+    step_names = {step['name'] for step in steps}
+    pending = list(steps)
+    running = {}
+    step_stats = {}
+    start = time.perf_counter()
+
+    with pool_executor(max_workers) as pool:
+        while pending or running:
+            for step in list(pending):
+                dependencies = [
+                    dependency for dependency in step['depends_on']
+                    if dependency in step_names
+                ]
+
+                if all(dependency in step_stats for dependency in dependencies):
+                    future = pool.submit(
+                        build_step,
+                        step,
+                        db_path,
+                        {dependency: step_path(build_dir, dependency) for dependency in dependencies},
+                        step_path(build_dir, step['name']),
+                    )
+                    running[future] = step['name']
+                    pending.remove(step)
+
+            finished, _ = concurrent.futures.wait(
+                running,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+
+            for future in finished:
+                name = running.pop(future)
+                step_stats[name] = future.result()
+                step_stats[name]['finished'] = time.perf_counter() - start
+                print(
+                    f'{name}: {step_stats[name]["rows"]:,} rows in {step_stats[name]["seconds"]:.2f}s '
+                    f'({step_stats[name]["finished"]:.2f}s elapsed)'
+                )
+
+    merge_start = time.perf_counter()
+    merge(db_path, steps, build_dir)
+    merge_seconds = time.perf_counter() - merge_start
+
+    print(f'built {len(steps)} tables in {time.perf_counter() - start:.2f}s')
+
+    return step_stats, merge_seconds
@@ -0,0 +1,159 @@
+import os
+import sqlite3
+import time
+
+import staging
+
+
+# lap-level tables are stored in one database per season instead of the main
+# database, so reading one race only touches that season's file, and
+# rebuilding the current season only rewrites one small one. etl_shard maps
+# each table and season to its file. shard files are never written in place:
+# a build writes new ones and points its copy of etl_shard at them, so
+# swapping in the main database switches readers to the new shards with it
+
+
+def shard_dir(db_path):
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), 'shards')
+
+
+def paths(con, name):
+    # the shard of each season of the table, as absolute paths
+    exists = con.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'etl_shard'"
+    ).fetchone()
+
+    if exists is None:
+        return {}
+
+    db_path = con.execute("SELECT file FROM pragma_database_list WHERE name = 'main'").fetchone()[0]
+
+    return {
+        year: os.path.join(shard_dir(db_path), path)
+        for year, path in con.execute('SELECT year, path FROM etl_shard WHERE name = ? ORDER BY year', (name,))
+    }
+
+
+def write_shard(db_path, step_path, name, schema, year, shard_path):
+    shard = sqlite3.connect(shard_path, isolation_level=None)
+    try:
+        staging.set_build_pragmas(shard, None)
+        shard.execute('ATTACH DATABASE ? AS step', (step_path,))
+        shard.execute('ATTACH DATABASE ? AS warehouse', (db_path,))
+
+        shard.execute('BEGIN')
+        for type, sql in schema:
+            shard.execute(sql)
+            if type == 'table':
+                shard.execute(f'''
+                    INSERT INTO main.{name}
+                    SELECT *
+                    FROM step.{name}
+                    WHERE race_k IN (SELECT race_k FROM warehouse.dim_race WHERE year = {year})
+                ''')
+        shard.execute('COMMIT')
+
+        shard.execute('ANALYZE main')
+    finally:
+        shard.close()
+
+
+def write(db_path, step_path, name):
+    # splits a built table into a shard for each season it has rows for, and
+    # drops the table from the main database, where older builds kept it.
+    # seasons the table has no rows for keep their current shard
+    directory = shard_dir(db_path)
+    os.makedirs(directory, exist_ok=True)
+
+    version = f'{time.strftime("%Y%m%d%H%M%S")}_{os.getpid()}'
+
+    con = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        staging.set_build_pragmas(con, None)
+        con.execute('ATTACH DATABASE ? AS step', (step_path,))
+
+        schema = con.execute(
+            '''
+                SELECT type, sql
+                FROM step.sqlite_master
+                WHERE tbl_name = ? AND sql IS NOT NULL
+                ORDER BY type = 'index'
+            ''',
+            (name,)
+        ).fetchall()
+        years = [
+            year
+            for (year,) in con.execute(f'''
+                SELECT year
+                FROM main.dim_race
+                WHERE race_k IN (SELECT race_k FROM step.{name})
+                GROUP BY year
+                ORDER BY year
+            ''')
+        ]
+
+        con.execute('DETACH DATABASE step')
+
+        filenames = {}
+        for year in years:
+            filenames[year] = f'{name}_{year}_{version}.db'
+            write_shard(db_path, step_path, name, schema, year, os.path.join(directory, filenames[year]))
+
+        con.execute('BEGIN')
+        con.execute('''
+            CREATE TABLE IF NOT EXISTS etl_shard (
+                name TEXT NOT NULL,
+                year INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                PRIMARY KEY (name, year)
+            )
+        ''')
+        con.executemany(
+            'INSERT OR REPLACE INTO etl_shard (name, year, path) VALUES (?, ?, ?)',
+            [(name, year, filename) for year, filename in filenames.items()],
+        )
+        con.execute(f'DROP TABLE IF EXISTS main.{name}')
+        con.execute('COMMIT')
+    finally:
+        con.close()
+
+
+def forget_unbuilt(db_path, names):
+    # drops the shards of tables that are no longer built from etl_shard, so
+    # remove_unused removes their files too
+    con = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        exists = con.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'etl_shard'"
+        ).fetchone()
+
+        if exists is not None:
+            con.execute(
+                f'DELETE FROM etl_shard WHERE name NOT IN ({", ".join("?" for _ in names)})',
+                list(names),
+            )
+    finally:
+        con.close()
+
+
+def remove_unused(db_path):
+    # removes shard files the live database doesn't point at: ones replaced
+    # by this build, and ones written by builds that failed. readers still
+    # attached to a replaced shard keep reading it until they detach
+    directory = shard_dir(db_path)
+
+    if not os.path.isdir(directory):
+        return
+
+    con = sqlite3.connect(db_path)
+    try:
+        exists = con.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'etl_shard'"
+        ).fetchone()
+        used = {path for (path,) in con.execute('SELECT path FROM etl_shard')} if exists else set()
+    finally:
+        con.close()
+
+    for filename in os.listdir(directory):
+        if filename.endswith('.db') and filename not in used:
+            os.remove(os.path.join(directory, filename))
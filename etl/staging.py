@@ -0,0 +1,237 @@
+import csv
+import time
+
+import csv_source
+
+
+# sqlite applies these column affinities as rows are inserted, so the csv text
+# is converted to integers/reals by the database rather than by pandas.
+# columns not listed here (e.g. ones kaggle adds later) get NUMERIC affinity
+column_types = {
+    'stg_circuits': {
+        'circuitId': 'INTEGER',
+        'circuitRef': 'TEXT',
+        'name': 'TEXT',
+        'location': 'TEXT',
+        'country': 'TEXT',
+        'lat': 'REAL',
+        'lng': 'REAL',
+        'alt': 'INTEGER',
+        'url': 'TEXT',
+    },
+    'stg_constructor_color': {
+        'constructorId': 'INTEGER',
+        'name': 'TEXT',
+        'auto_color': 'TEXT',
+        'custom_color': 'TEXT',
+    },
+    'stg_constructor_results': {
+        'constructorResultsId': 'INTEGER',
+        'raceId': 'INTEGER',
+        'constructorId': 'INTEGER',
+        'points': 'REAL',
+        'status': 'TEXT',
+    },
+    'stg_constructor_standings': {
+        'constructorStandingsId': 'INTEGER',
+        'raceId': 'INTEGER',
+        'constructorId': 'INTEGER',
+        'points': 'REAL',
+        'position': 'INTEGER',
+        'positionText': 'TEXT',
+        'wins': 'INTEGER',
+    },
+    'stg_constructors': {
+        'constructorId': 'INTEGER',
+        'constructorRef': 'TEXT',
+        'name': 'TEXT',
+        'nationality': 'TEXT',
+        'url': 'TEXT',
+    },
+    'stg_driver_standings': {
+        'driverStandingsId': 'INTEGER',
+        'raceId': 'INTEGER',
+        'driverId': 'INTEGER',
+        'points': 'REAL',
+        'position': 'INTEGER',
+        'positionText': 'TEXT',
+        'wins': 'INTEGER',
+    },
+    'stg_drivers': {
+        'driverId': 'INTEGER',
+        'driverRef': 'TEXT',
+        'number': 'INTEGER',
+        'code': 'TEXT',
+        'forename': 'TEXT',
+        'surname': 'TEXT',
+        'dob': 'TEXT',
+        'nationality': 'TEXT',
+        'url': 'TEXT',
+    },
+    'stg_lap_times': {
+        'raceId': 'INTEGER',
+        'driverId': 'INTEGER',
+        'lap': 'INTEGER',
+        'position': 'INTEGER',
+        'time': 'TEXT',
+        'milliseconds': 'INTEGER',
+    },
+    'stg_pit_stops': {
+        'raceId': 'INTEGER',
+        'driverId': 'INTEGER',
+        'stop': 'INTEGER',
+        'lap': 'INTEGER',
+        'time': 'TEXT',
+        'duration': 'TEXT',
+        'milliseconds': 'INTEGER',
+    },
+    'stg_qualifying': {
+        'qualifyId': 'INTEGER',
+        'raceId': 'INTEGER',
+        'driverId': 'INTEGER',
+        'constructorId': 'INTEGER',
+        'number': 'INTEGER',
+        'position': 'INTEGER',
+        'q1': 'TEXT',
+        'q2': 'TEXT',
+        'q3': 'TEXT',
+    },
+    'stg_races': {
+        'raceId': 'INTEGER',
+        'year': 'INTEGER',
+        'round': 'INTEGER',
+        'circuitId': 'INTEGER',
+        'name': 'TEXT',
+        'date': 'TEXT',
+        'time': 'TEXT',
+        'url': 'TEXT',
+    },
+    'stg_results': {
+        'resultId': 'INTEGER',
+        'raceId': 'INTEGER',
+        'driverId': 'INTEGER',
+        'constructorId': 'INTEGER',
+        'number': 'REAL',
+        'grid': 'INTEGER',
+        'position': 'INTEGER',
+        'positionText': 'TEXT',
+        'positionOrder': 'INTEGER',
+        'points': 'REAL',
+        'laps': 'INTEGER',
+        'time': 'TEXT',
+        'milliseconds': 'REAL',
+        'fastestLap': 'REAL',
+        'rank': 'REAL',
+        'fastestLapTime': 'TEXT',
+        'fastestLapSpeed': 'REAL',
+        'statusId': 'INTEGER',
+    },
+    'stg_seasons': {
+        'year': 'INTEGER',
+        'url': 'TEXT',
+    },
+    'stg_sprint_results': {
+        'resultId': 'INTEGER',
+        'raceId': 'INTEGER',
+        'driverId': 'INTEGER',
+        'constructorId': 'INTEGER',
+        'number': 'REAL',
+        'grid': 'INTEGER',
+        'position': 'INTEGER',
+        'positionText': 'TEXT',
+        'positionOrder': 'INTEGER',
+        'points': 'REAL',
+        'laps': 'INTEGER',
+        'time': 'TEXT',
+        'milliseconds': 'REAL',
+        'fastestLap': 'REAL',
+        'fastestLapTime': 'TEXT',
+        'statusId': 'INTEGER',
+    },
+    'stg_status': {
+        'statusId': 'INTEGER',
+        'status': 'TEXT',
+    },
+}
+
+# the fields staged as NULL: the dataset's '\N', and the strings
+# pd.read_csv reads as missing by default, which the build read as NULL
+# before it staged the csvs itself
+na_values = [
+    '\\N', '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+    '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'n/a', 'nan', 'null',
+]
+
+# created once the rows are in, on the columns the build steps join on
+indexes = {
+    'stg_constructor_color': [['constructorId']],
+    'stg_races': [['raceId']],
+    'stg_results': [['raceId', 'driverId']],
+    'stg_status': [['statusId']],
+}
+
+# the staging tables are thrown away at the end of every run and the whole
+# database is rebuilt from the csvs if a run dies, so durability is not needed
+build_pragmas = [
+    'PRAGMA journal_mode = OFF',
+    'PRAGMA synchronous = OFF',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -262144',
+]
+
+
+def set_build_pragmas(dbapi_connection, connection_record):
+    for pragma in build_pragmas:
+        dbapi_connection.execute(pragma)
+
+
+def load(dbapi_connection, sources, table_names):
+    # loads every csv inside one transaction using a single prepared insert per
+    # table. rows are streamed from the source into the insert, so memory use
+    # doesn't grow with the file. fields in na_values become NULL. returns the
+    # row count and load time of each table
+    table_stats = {}
+    cursor = dbapi_connection.cursor()
+    cursor.execute('BEGIN')
+
+    for table_name in table_names:
+        start = time.perf_counter()
+
+        with csv_source.open_text(sources[table_name]) as file:
+            reader = csv.reader(file)
+            header = next(reader)
+            types = column_types.get(table_name, {})
+
+            cursor.execute(f'DROP TABLE IF EXISTS {table_name}')
+            cursor.execute(
+                f'CREATE TABLE {table_name} ('
+                + ', '.join(f'"{column}" {types.get(column, "NUMERIC")}' for column in header)
+                + ')'
+            )
+            na_cases = ' '.join("WHEN '" + value.replace("'", "''") + "' THEN NULL" for value in na_values)
+            cursor.executemany(
+                f'INSERT INTO {table_name} VALUES ('
+                + ', '.join(f'CASE ?{i} {na_cases} ELSE ?{i} END' for i in range(1, len(header) + 1))
+                + ')',
+                reader,
+            )
+            rows = cursor.rowcount
+
+        for columns in indexes.get(table_name, []):
+            cursor.execute(
+                f'CREATE INDEX "{table_name}_{"_".join(columns)}" ON {table_name} ('
+                + ', '.join(f'"{column}"' for column in columns)
+                + ')'
+            )
+
+        seconds = time.perf_counter() - start
+        table_stats[table_name] = {
+            'rows': rows,
+            'seconds': seconds,
+            'rows_per_second': rows / max(seconds, 1e-9),
+        }
+        print(f'{table_name}: {rows:,} rows in {seconds:.2f}s ({table_stats[table_name]["rows_per_second"]:,.0f} rows/sec)')
+
+    dbapi_connection.commit()
+
+    return table_stats
@@ -0,0 +1,1071 @@
+# each step builds one table from the staging tables and/or earlier steps.
+# steps are listed in dependency order, and 'depends_on' names every table the
+# step's sql reads so the etl can work out what needs rebuilding.
+# dims and facts declare their schema (types, keys, indexes) up front and fill
+# it with 'sql'; steps with no 'schema' create their table from 'sql' directly.
+# steps with 'shard' set to 'season' are stored in one database per season
+# (see shards.py) rather than in the main database, so no step can read them.
+# steps listed in packing.py select rows that are packed into their table in
+# python.
+steps = [
+    {
+        'name': 'dim_circuit',
+        'depends_on': ['stg_circuits'],
+        'schema': '''
+            CREATE TABLE dim_circuit (
+                circuit_k INTEGER PRIMARY KEY,
+                ref TEXT,
+                name TEXT,
+                location TEXT,
+                country TEXT,
+                latitude REAL,
+                longitude REAL,
+                altitude REAL,
+                wiki_url TEXT
+            );
+        ''',
+        'sql': '''
+        --sql
+
+        INSERT INTO dim_circuit
+            SELECT
+                circuitId AS circuit_k,
+                circuitRef AS ref,
+                name,
+                location,
+                country,
+                lat AS latitude,
+                lng AS longitude,
+                alt AS altitude,
+                url AS wiki_url
+            FROM stg_circuits;
+        ''',
+        'indexes': [],
+    },
+    {
+        'name': 'dim_constructor',
+        'depends_on': ['stg_constructors', 'stg_constructor_color'],
+        'schema': '''
+            CREATE TABLE dim_constructor (
+                constructor_k INTEGER PRIMARY KEY,
+                ref TEXT,
+                name TEXT,
+                nationality TEXT,
+                wiki_url TEXT,
+                color TEXT
+            );
+        ''',
+        'sql': '''
+        --sql
+
+        INSERT INTO dim_constructor
+            SELECT
+                c.constructorId AS constructor_k,
+                c.constructorRef AS ref,
+                c.name,
+                c.nationality,
+                c.url AS wiki_url,
+                CAST(COALESCE(cs.custom_color, cs.auto_color) AS TEXT) AS color
+            FROM
+                stg_constructors AS c
+                LEFT JOIN stg_constructor_color AS cs
+                    ON c.constructorId = cs.constructorId;
+        ''',
+        'indexes': [],
+    },
+    {
+        'name': 'dim_driver',
+        'depends_on': ['stg_drivers'],
+        'schema': '''
+            CREATE TABLE dim_driver (
+                driver_k INTEGER PRIMARY KEY,
+                ref TEXT,
+                number INTEGER,
+                code TEXT,
+                first_name TEXT,
+                last_name TEXT,
+                full_name TEXT,
+                dob TEXT,
+                nationality TEXT,
+                wiki_url TEXT
+            );
+        ''',
+        'sql': '''
+        --sql
+
+        INSERT INTO dim_driver
+            SELECT
+                driverId AS driver_k,
+                driverRef AS ref,
+                number,
+                code,
+                forename AS first_name,
+                surname AS last_name,
+                CAST(forename || ' ' || surname AS TEXT) AS full_name,
+                dob,
+                nationality,
+                url AS wiki_url
+            FROM stg_drivers;
+        ''',
+        'indexes': [],
+    },
+    {
+        'name': 'fact_lap',
+        'depends_on': ['stg_results', 'stg_lap_times', 'stg_status'],
+        'schema': '''
+            CREATE TABLE fact_lap (
+                race_k INTEGER NOT NULL,
+                driver_k INTEGER NOT NULL,
+                lap INTEGER NOT NULL,
+                position INTEGER,
+                time TEXT,
+                milliseconds INTEGER,
+                is_final INTEGER NOT NULL
+            );
+        ''',
+        'sql': '''
+        --sql
+
+        INSERT INTO fact_lap
+            WITH
+                lap_zero AS (
+                    SELECT
+                        rr.raceId AS race_k,
+                        rr.driverId AS driver_k,
+                        CAST(0 AS INTEGER) AS lap,
+                        rr.grid AS position,
+                        CAST(NULL AS INTEGER) AS time,
+                        CAST(NULL AS INTEGER) AS milliseconds
+                    FROM stg_results AS rr
+                    WHERE rr.grid <> 0
+                ),
+                real_laps AS (
+                    SELECT
+                        raceId AS race_k,
+                        driverId AS driver_k,
+                        lap,
+                        position,
+                        time,
+                        milliseconds
+                    FROM stg_lap_times
+                ),
+                zero_and_real_laps AS (
+                    SELECT * FROM lap_zero
+                    UNION ALL
+                    SELECT * FROM real_laps
+                ),
+                dnf_laps AS (
+                    WITH
+                        max_laps AS (
+                            SELECT
+                                race_k,
+                                MAX(lap) AS max_lap
+                            FROM zero_and_real_laps
+                            GROUP BY race_k
+                        ),
+                        last_laps AS (
+                            SELECT
+                                race_k,
+                                driver_k,
+                                lap,
+                                position,
+                                time,
+                                milliseconds,
+                                ROW_NUMBER() OVER (PARTITION BY race_k, driver_k ORDER BY lap DESC) = 1 AS is_final
+                            FROM zero_and_real_laps
+                        )
+                    SELECT
+                        ll.race_k,
+                        ll.driver_k,
+                        ll.lap + 1 AS lap,
+                        CAST(rr.positionOrder AS INTEGER) AS position,
+                        NULL AS time,
+                        NULL AS milliseconds
+                    FROM
+                        last_laps AS ll
+                        LEFT JOIN max_laps AS ml
+                            ON ll.race_k = ml.race_k
+                        LEFT JOIN stg_results AS rr
+                            ON ll.race_k = rr.raceId
+                            AND ll.driver_k = rr.driverId
+                        LEFT JOIN stg_status AS s
+                            ON rr.statusId = s.statusId
+                    WHERE TRUE
+                        AND ll.is_final
+                        AND ll.lap < ml.max_lap
+                        AND NOT s.status LIKE '+% Lap%'
+                ),
+                combined_laps AS (
+                    SELECT * FROM lap_zero
+                    UNION ALL
+                    SELECT * FROM real_laps
+                    UNION ALL
+                    SELECT * FROM dnf_laps
+                )
+            SELECT
+                race_k,
+                driver_k,
+                lap,
+                position,
+                time,
+                milliseconds,
+                CAST(
+                    ROW_NUMBER() OVER (
+                        PARTITION BY race_k, driver_k
+                        ORDER BY lap DESC
+                    ) = 1 AS INTEGER
+                ) AS is_final
+            FROM combined_laps;
+        ''',
+        'indexes': [
+            '''
+                CREATE INDEX "fact_lap_race_k_driver_k_lap" ON "fact_lap" (
+                    "race_k",
+                    "driver_k",
+                    "lap"
+                );
+            ''',
+            '''
+                CREATE INDEX "fact_lap_driver_k" ON "fact_lap" (
+                    "driver_k"
+                );
+            ''',
+        ],
+    },
+    {
+        'name': 'fact_pit_stop',
+        'depends_on': ['stg_pit_stops'],
+        'schema': '''
+            CREATE TABLE fact_pit_stop (
+                race_k INTEGER NOT NULL,
+                driver_k INTEGER NOT NULL,
+                lap INTEGER,
+                stop INTEGER,
+                time TEXT,
+                duration TEXT,
+                milliseconds INTEGER
+            );
+        ''',
+        'sql': '''
+        --sql
+
+        INSERT INTO fact_pit_stop
+            SELECT
+                raceId AS race_k,
+                driverId AS driver_k,
+                lap,
+                stop,
+                time,
+                duration,
+                milliseconds
+            FROM stg_pit_stops;
+        ''',
+        'indexes': [
+            '''
+                CREATE INDEX "fact_pit_stop_race_k_driver_k_lap" ON "fact_pit_stop" (
+                    "race_k",
+                    "driver_k",
+                    "lap"
+                );
+            ''',
+            '''
+                CREATE INDEX "fact_pit_stop_driver_k" ON "fact_pit_stop" (
+                    "driver_k"
+                );
+            ''',
+        ],
+    },
+    {
+        'name': 'fact_qualifying',
+        'depends_on': ['stg_qualifying'],
+        'schema': '''
+            CREATE TABLE fact_qualifying (
+                race_k INTEGER NOT NULL,
+                driver_k INTEGER NOT NULL,
+                constructor_k INTEGER,
+                number INTEGER,
+                position INTEGER,
+                q1 TEXT,
+                q2 TEXT,
+                q3 TEXT
+            );
+        ''',
+        'sql': '''
+        --sql
+
+        INSERT INTO fact_qualifying
+            SELECT
+                raceId AS race_k,
+                driverId AS driver_k,
+                constructorId AS constructor_k,
+                number,
+                position,
+                q1,
+                q2,
+                q3
+            FROM stg_qualifying;
+        ''',
+        'indexes': [
+            '''
+                CREATE INDEX "fact_qualifying_race_k_driver_k" ON "fact_qualifying" (
+                    "race_k",
+                    "driver_k"
+                );
+            ''',
+            '''
+                CREATE INDEX "fact_qualifying_driver_k" ON "fact_qualifying" (
+                    "driver_k"
+                );
+            ''',
+            '''
+                CREATE INDEX "fact_qualifying_constructor_k" ON "fact_qualifying" (
+                    "constructor_k"
+                );
+            ''',
+        ],
+    },
+    {
+        'name': 'dim_race',
+        'depends_on': ['stg_races'],
+        'schema': '''
+            CREATE TABLE dim_race (
+                race_k INTEGER PRIMARY KEY,
+                circuit_k INTEGER,
+                year INTEGER,
+                round INTEGER,
+                name TEXT,
+                date TEXT,
+                time TEXT,
+                wiki_url TEXT
+            );
+        ''',
+        'sql': '''
+        --sql
+
+        INSERT INTO dim_race
+            SELECT
+                raceId AS race_k,
+                circuitId AS circuit_k,
+                year,
+                round,
+                name,
+                CAST(CASE
+                    WHEN date LIKE '%/%' THEN
+                        CASE
+                            WHEN CAST(substr(date, 7, 2) AS INTEGER) >= 50 THEN '19'
+                            ELSE '20'
+                        END || substr(date, 7, 2) || '-' ||
+                        substr(date, 4, 2) || '-' ||
+                        substr(date, 1, 2)
+                    ELSE date
+                END AS TEXT) AS date,
+                time,
+                url AS wiki_url
+            FROM stg_races;
+        ''',
+        'indexes': [
+            '''
+                CREATE INDEX "dim_race_year_name" ON "dim_race" (
+                    "year",
+                    "name"
+                );
+            ''',
+            '''
+                CREATE INDEX "dim_race_circuit_k" ON "dim_race" (
+                    "circuit_k"
+                );
+            ''',
+        ],
+    },
+    {
+        'name': 'fact_race_result',
+        'depends_on': ['stg_results', 'stg_sprint_results', 'stg_status'],
+        'schema': '''
+            CREATE TABLE fact_race_result (
+                race_k INTEGER NOT NULL,
+                driver_k INTEGER NOT NULL,
+                constructor_k INTEGER,
+                is_sprint INTEGER NOT NULL,
+                number REAL,
+                grid INTEGER,
+                position INTEGER,
+                position_text TEXT,
+                position_order INTEGER,
+                points REAL,
+                laps INTEGER,
+                time TEXT,
+                milliseconds REAL,
+                fastest_lap REAL,
+                rank REAL,
+                fastest_lap_time TEXT,
+                fastest_lap_speed REAL,
+                status TEXT
+            );
+        ''',
+        'sql': '''
+        --sql
+
+        INSERT INTO fact_race_result
+            SELECT
+                r.raceId AS race_k,
+                r.driverId AS driver_k,
+                r.constructorId AS constructor_k,
+                CAST(FALSE AS INTEGER) AS is_sprint,
+                r.number,
+                r.grid,
+                CAST(r.position AS INTEGER) AS position,
+                r.positionText AS position_text,
+                CAST(r.positionOrder AS INTEGER) AS position_order,
+                r.points,
+                r.laps,
+                r.time,
+                r.milliseconds,
+                r.fastestLap AS fastest_lap,
+                r.rank,
+                r.fastestLapTime AS fastest_lap_time,
+                r.fastestLapSpeed AS fastest_lap_speed,
+                s.status
+            FROM
+                stg_results AS r
+                LEFT JOIN stg_status AS s
+                    ON r.statusId = s.statusId
+            UNION ALL
+            SELECT
+                sr.raceId AS race_k,
+                sr.driverId AS driver_k,
+                sr.constructorId AS constructor_k,
+                CAST(TRUE AS INTEGER) AS is_sprint,
+                sr.number,
+                sr.grid,
+                CAST(sr.position AS INTEGER) AS position,
+                sr.positionText AS position_text,
+                CAST(sr.positionOrder AS INTEGER) AS position_order,
+                sr.points,
+                sr.laps,
+                sr.time,
+                sr.milliseconds,
+                sr.fastestLap AS fastest_lap,
+                NULL AS rank,
+                sr.fastestLapTime AS fastest_lap_time,
+                NULL AS fastest_lap_speed,
+                s.status
+            FROM
+                stg_sprint_results AS sr
+                LEFT JOIN stg_status AS s
+                    ON sr.statusId = s.statusId;
+        ''',
+        'indexes': [
+            '''
+                CREATE INDEX "fact_race_result_race_k_driver_k" ON "fact_race_result" (
+                    "race_k",
+                    "driver_k"
+                );
+            ''',
+            '''
+                CREATE INDEX "fact_race_result_driver_k" ON "fact_race_result" (
+                    "driver_k"
+                );
+            ''',
+            '''
+                CREATE INDEX "fact_race_result_constructor_k_race_k" ON "fact_race_result" (
+                    "constructor_k",
+                    "race_k"
+                );
+            ''',
+        ],
+    },
+    {
+        'name': 'dim_season',
+        'depends_on': ['stg_seasons'],
+        'schema': '''
+            CREATE TABLE dim_season (
+                year INTEGER PRIMARY KEY,
+                wiki_url TEXT
+            );
+        ''',
+        'sql': '''
+        --sql
+
+        INSERT INTO dim_season
+            SELECT
+                year,
+                url AS wiki_url
+            FROM stg_seasons;
+        ''',
+        'indexes': [],
+    },
+    {
+        'name': 'dim_driver_constructor',
+        'depends_on': ['stg_results', 'stg_races'],
+        'schema': '''
+            CREATE TABLE dim_driver_constructor (
+                year INTEGER NOT NULL,
+                constructor_k INTEGER,
+                driver_k INTEGER NOT NULL,
+                PRIMARY KEY (year, driver_k)
+            ) WITHOUT ROWID;
+        ''',
+        'sql': '''
+        --sql
+
+        INSERT INTO dim_driver_constructor
+            WITH
+                driver_constructor_races AS (
+                    SELECT
+                        ra.year,
+                        re.constructorId,
+                        re.driverId,
+                        ROW_NUMBER() OVER (
+                            PARTITION BY
+                                ra.year,
+                                re.driverId
+                            ORDER BY
+                                COUNT(DISTINCT re.raceId) DESC,
+                                re.constructorId
+                        ) AS row_num
+                    FROM
+                        stg_results AS re
+                        LEFT JOIN stg_races AS ra
+                            ON re.raceId = ra.raceId
+                    GROUP BY
+                        ra.year,
+                        re.constructorId,
+                        re.driverId
+                )
+            SELECT
+                year,
+                constructorId AS constructor_k,
+                driverId AS driver_k
+            FROM driver_constructor_races
+            WHERE row_num = 1;
+        ''',
+        'indexes': [
+            '''
+                CREATE INDEX "dim_driver_constructor_constructor_k" ON "dim_driver_constructor" (
+                    "constructor_k"
+                );
+            ''',
+        ],
+    },
+    {
+        'name': 'dim_metric',
+        'depends_on': [],
+        'schema': '''
+            CREATE TABLE dim_metric (
+                metric_k INTEGER PRIMARY KEY,
+                metric TEXT NOT NULL UNIQUE
+            );
+        ''',
+        'sql': '''
+        --sql
+
+        INSERT INTO dim_metric
+            VALUES
+                (1, 'Points'),
+                (2, 'Race Wins'),
+                (3, 'Podiums'),
+                (4, 'Championships');
+        ''',
+        'indexes': [],
+    },
+    {
+        'name': 'dim_type',
+        'depends_on': [],
+        'schema': '''
+            CREATE TABLE dim_type (
+                type_k INTEGER PRIMARY KEY,
+                type TEXT NOT NULL UNIQUE
+            );
+        ''',
+        'sql': '''
+        --sql
+
+        INSERT INTO dim_type
+            VALUES
+                (1, 'Driver'),
+                (2, 'Constructor');
+        ''',
+        'indexes': [],
+    },
+    {
+        'name': 'report_seasons_metrics',
+        'depends_on': ['dim_season', 'dim_race', 'fact_race_result', 'dim_driver', 'dim_driver_constructor', 'dim_constructor'],
+        'schema': None,
+        'sql': '''
+        --sql
+
+        CREATE TABLE report_seasons_metrics AS
+            WITH RECURSIVE
+                vector(idx) AS (
+                    SELECT 0 AS idx
+                    UNION ALL
+                    SELECT idx + 1 AS idx
+                    FROM vector
+                    WHERE vector.idx <= 10
+                ),
+                seasons AS (
+                    SELECT
+                        year,
+                        wiki_url
+                    FROM dim_season
+                    WHERE year IN (SELECT year FROM dim_race)
+                ),
+                -- only the drivers and constructors that took part in a season.
+                -- the app pads a season's top n with the others, see
+                -- app/queries.py
+                driver_metrics AS (
+                    SELECT
+                        r.year,
+                        'Driver' AS type,
+                        rr.driver_k AS id,
+                        SUM(rr.points) AS points,
+                        SUM(CASE WHEN NOT rr.is_sprint THEN rr.position = 1 ELSE 0 END) AS race_wins,
+                        SUM(CASE WHEN NOT rr.is_sprint THEN rr.position BETWEEN 1 AND 3 ELSE 0 END) AS podiums,
+                        CAST(ROW_NUMBER() OVER (PARTITION BY r.year ORDER BY SUM(rr.points) DESC, rr.driver_k) = 1 AS INTEGER) AS championships
+                    FROM
+                        fact_race_result AS rr
+                        INNER JOIN dim_race AS r
+                            ON rr.race_k = r.race_k
+                        INNER JOIN seasons AS s
+                            ON r.year = s.year
+                    GROUP BY
+                        r.year,
+                        rr.driver_k
+                ),
+                constructor_metrics AS (
+                    SELECT
+                        r.year,
+                        'Constructor' AS type,
+                        rr.constructor_k AS id,
+                        SUM(rr.points) AS points,
+                        SUM(CASE WHEN NOT rr.is_sprint THEN rr.position = 1 ELSE 0 END) AS race_wins,
+                        SUM(CASE WHEN NOT rr.is_sprint THEN rr.position BETWEEN 1 AND 3 ELSE 0 END) AS podiums,
+                        CAST(ROW_NUMBER() OVER (PARTITION BY r.year ORDER BY SUM(rr.points) DESC, rr.constructor_k) = 1 AS INTEGER) AS championships
+                    FROM
+                        fact_race_result AS rr
+                        INNER JOIN dim_race AS r
+                            ON rr.race_k = r.race_k
+                        INNER JOIN seasons AS s
+                            ON r.year = s.year
+                    GROUP BY
+                        r.year,
+                        rr.constructor_k
+                ),
+                combined_metrics AS (
+                    SELECT * FROM driver_metrics
+                    UNION ALL
+                    SELECT * FROM constructor_metrics
+                ),
+                unpivoted_metrics AS (
+                    SELECT
+                        m.year,
+                        m.type,
+                        m.id,
+                        CASE
+                            WHEN v.idx = 0 THEN 'Points'
+                            WHEN v.idx = 1 THEN 'Race Wins'
+                            WHEN v.idx = 2 THEN 'Podiums'
+                            WHEN v.idx = 3 THEN 'Championships'
+                        END AS metric,
+                        CASE
+                            WHEN v.idx = 0 THEN m.points
+                            WHEN v.idx = 1 THEN m.race_wins
+                            WHEN v.idx = 2 THEN m.podiums
+                            WHEN v.idx = 3 THEN m.championships
+                        END AS metric_value
+                    FROM
+                        combined_metrics AS m
+                        CROSS JOIN vector AS v
+                    WHERE v.idx <= 3
+                ),
+                -- seasons an entity sat out after it first scored in a metric.
+                -- totals never go down, so these are exactly the seasons where
+                -- it has a nonzero running total but no row of its own. like
+                -- entities the app pads a season's top n with, it has no
+                -- points rather than 0 in a season it didn't race
+                carried_metrics AS (
+                    SELECT
+                        s.year,
+                        f.type,
+                        f.id,
+                        f.metric,
+                        CASE WHEN f.metric = 'Points' THEN NULL ELSE 0 END AS metric_value
+                    FROM
+                        (
+                            SELECT
+                                type,
+                                id,
+                                metric,
+                                MIN(year) AS first_scoring_year
+                            FROM unpivoted_metrics
+                            WHERE metric_value <> 0
+                            GROUP BY
+                                type,
+                                id,
+                                metric
+                        ) AS f
+                        INNER JOIN seasons AS s
+                            ON s.year > f.first_scoring_year
+                        LEFT JOIN combined_metrics AS m
+                            ON s.year = m.year
+                            AND f.type = m.type
+                            AND f.id = m.id
+                    WHERE m.id IS NULL
+                ),
+                sparse_metrics AS (
+                    SELECT * FROM unpivoted_metrics
+                    UNION ALL
+                    SELECT * FROM carried_metrics
+                ),
+                -- all-time running totals, so a total from any start year is
+                -- this year's value minus the value the year before it starts.
+                -- ties are ranked by id so the app can reproduce these rankings
+                cumulative_metrics AS (
+                    SELECT
+                        *,
+                        SUM(COALESCE(metric_value, 0)) OVER (
+                            PARTITION BY
+                                id,
+                                type,
+                                metric
+                            ORDER BY
+                                year
+                            ROWS BETWEEN
+                                UNBOUNDED PRECEDING
+                                AND CURRENT ROW
+                        ) AS cumulative_metric_value
+                    FROM sparse_metrics
+                ),
+                described_metrics AS (
+                    SELECT
+                        m.year,
+                        m.type,
+                        m.id,
+                        d.full_name AS name,
+                        COALESCE(c.name, 'No Constructor') AS constructor_name,
+                        COALESCE(c.color, '#BAB0AC') AS constructor_color,
+                        d.wiki_url,
+                        s.wiki_url AS season_wiki_url,
+                        m.metric,
+                        m.metric_value,
+                        m.cumulative_metric_value
+                    FROM
+                        cumulative_metrics AS m
+                        INNER JOIN seasons AS s
+                            ON m.year = s.year
+                        INNER JOIN dim_driver AS d
+                            ON m.id = d.driver_k
+                        LEFT JOIN dim_driver_constructor AS dc
+                            ON m.year = dc.year
+                            AND m.id = dc.driver_k
+                        LEFT JOIN dim_constructor AS c
+                            ON dc.constructor_k = c.constructor_k
+                    WHERE m.type = 'Driver'
+                    UNION ALL
+                    SELECT
+                        m.year,
+                        m.type,
+                        m.id,
+                        c.name,
+                        c.name AS constructor_name,
+                        c.color AS constructor_color,
+                        c.wiki_url,
+                        s.wiki_url AS season_wiki_url,
+                        m.metric,
+                        m.metric_value,
+                        m.cumulative_metric_value
+                    FROM
+                        cumulative_metrics AS m
+                        INNER JOIN seasons AS s
+                            ON m.year = s.year
+                        INNER JOIN dim_constructor AS c
+                            ON m.id = c.constructor_k
+                    WHERE m.type = 'Constructor'
+                ),
+                rankings AS (
+                    SELECT
+                        year,
+                        type,
+                        id,
+                        name,
+                        constructor_name,
+                        constructor_color,
+                        wiki_url,
+                        season_wiki_url,
+                        metric,
+                        metric_value,
+                        ROW_NUMBER() OVER (PARTITION BY year, type, metric ORDER BY metric_value DESC, id) AS position,
+                        cumulative_metric_value,
+                        ROW_NUMBER() OVER (PARTITION BY year, type, metric ORDER BY cumulative_metric_value DESC, id) AS cumulative_position
+                    FROM described_metrics
+                )
+            SELECT * FROM rankings
+            ORDER BY year, metric, type, position DESC;
+        ''',
+        'indexes': [
+            '''
+                CREATE INDEX "report_seasons_metrics_metric_year" ON "report_seasons_metrics" (
+                    "metric",
+                    "year",
+                    "type",
+                    "id"
+                );
+            ''',
+            '''
+                CREATE INDEX "report_seasons_metrics_metric_position" ON "report_seasons_metrics" (
+                    "metric",
+                    "position",
+                    "year"
+                );
+            ''',
+            '''
+                CREATE INDEX "report_seasons_metrics_metric_cumulative_position" ON "report_seasons_metrics" (
+                    "metric",
+                    "cumulative_position",
+                    "year"
+                );
+            ''',
+        ],
+    },
+    {
+        'name': 'report_season_metrics',
+        'depends_on': ['fact_race_result', 'dim_race', 'dim_metric', 'dim_type'],
+        'schema': None,
+        'sql': '''
+        --sql
+
+        -- names, colors and wiki urls are left as keys into the dims, and
+        -- metric/type as keys into their lookups, to keep rows narrow.
+        -- charts.py joins them back when it reads the table
+        CREATE TABLE report_season_metrics AS
+            WITH RECURSIVE
+                vector(idx) AS (
+                    SELECT 0 AS idx
+                    UNION ALL
+                    SELECT idx + 1 AS idx
+                    FROM vector
+                    WHERE idx <= 10
+                ),
+                season_drivers AS (
+                    SELECT
+                        r.year,
+                        rr.driver_k
+                    FROM
+                        fact_race_result AS rr
+                        LEFT JOIN dim_race AS r
+                            ON rr.race_k = r.race_k
+                    GROUP BY
+                        r.year,
+                        rr.driver_k
+                ),
+                season_constructors AS (
+                    SELECT
+                        r.year,
+                        rr.constructor_k
+                    FROM
+                        fact_race_result AS rr
+                        LEFT JOIN dim_race AS r
+                            ON rr.race_k = r.race_k
+                    GROUP BY
+                        r.year,
+                        rr.constructor_k
+                ),
+                season_races AS (
+                    SELECT
+                        r.*
+                    FROM dim_race AS r
+                    WHERE r.race_k IN (SELECT race_k FROM fact_race_result)
+                ),
+                driver_metrics AS (
+                    SELECT
+                        r.year,
+                        r.race_k,
+                        r.date AS race_date,
+                        'Driver' AS type,
+                        d.driver_k AS id,
+                        MAX(rr.constructor_k) AS constructor_k,
+                        SUM(rr.points) AS points,
+                        SUM(CASE WHEN NOT rr.is_sprint THEN rr.position = 1 ELSE 0 END) AS race_wins,
+                        SUM(CASE WHEN NOT rr.is_sprint THEN rr.position BETWEEN 1 AND 3 ELSE 0 END) AS podiums
+                    FROM
+                        season_drivers AS d
+                        INNER JOIN season_races AS r
+                            ON d.year = r.year
+                        LEFT JOIN fact_race_result AS rr
+                            ON r.race_k = rr.race_k
+                            AND d.driver_k = rr.driver_k
+                    GROUP BY
+                        r.year,
+                        r.race_k,
+                        r.date,
+                        d.driver_k
+                ),
+                constructor_metrics AS (
+                    SELECT
+                        r.year,
+                        r.race_k,
+                        r.date AS race_date,
+                        'Constructor' AS type,
+                        c.constructor_k AS id,
+                        c.constructor_k,
+                        SUM(rr.points) AS points,
+                        SUM(CASE WHEN NOT rr.is_sprint THEN rr.position = 1 ELSE 0 END) AS race_wins,
+                        SUM(CASE WHEN NOT rr.is_sprint THEN rr.position BETWEEN 1 AND 3 ELSE 0 END) AS podiums
+                    FROM
+                        season_constructors AS c
+                        INNER JOIN season_races AS r
+                            ON c.year = r.year
+                        LEFT JOIN fact_race_result AS rr
+                            ON r.race_k = rr.race_k
+                            AND c.constructor_k = rr.constructor_k
+                    GROUP BY
+                        r.year,
+                        r.race_k,
+                        r.date,
+                        c.constructor_k
+                ),
+                combined_metrics AS (
+                    SELECT * FROM driver_metrics
+                    UNION ALL
+                    SELECT * FROM constructor_metrics
+                ),
+                unpivoted_metrics AS (
+                    SELECT
+                        m.year,
+                        m.race_k,
+                        m.race_date,
+                        m.type,
+                        m.id,
+                        m.constructor_k,
+                        CASE
+                            WHEN v.idx = 0 THEN 'Points'
+                            WHEN v.idx = 1 THEN 'Race Wins'
+                            WHEN v.idx = 2 THEN 'Podiums'
+                        END AS metric,
+                        CASE
+                            WHEN v.idx = 0 THEN m.points
+                            WHEN v.idx = 1 THEN m.race_wins
+                            WHEN v.idx = 2 THEN m.podiums
+                        END AS metric_value,
+                        FALSE AS is_cumulative
+                    FROM
+                        combined_metrics AS m
+                        CROSS JOIN vector AS v
+                    WHERE v.idx <= 2
+                ),
+                cumulative_unpivoted_metrics AS (
+                    SELECT
+                        year,
+                        race_k,
+                        race_date,
+                        type,
+                        id,
+                        constructor_k,
+                        metric,
+                        SUM(COALESCE(metric_value, 0)) OVER (
+                            PARTITION BY
+                                year,
+                                id,
+                                type,
+                                metric
+                            ORDER BY
+                                race_date
+                            ROWS BETWEEN
+                                UNBOUNDED PRECEDING
+                                AND CURRENT ROW
+                        ) AS metric_value,
+                        TRUE AS is_cumulative
+                    FROM unpivoted_metrics
+                ),
+                combined_unpivoted_metrics AS (
+                    SELECT * FROM unpivoted_metrics
+                    UNION ALL
+                    SELECT * FROM cumulative_unpivoted_metrics
+                ),
+                rankings AS (
+                    SELECT
+                        year,
+                        race_k,
+                        race_date,
+                        type,
+                        id,
+                        constructor_k,
+                        metric,
+                        metric_value,
+                        is_cumulative,
+                        ROW_NUMBER() OVER (PARTITION BY year, race_k, type, is_cumulative, metric ORDER BY metric_value DESC, id) AS position
+                    FROM combined_unpivoted_metrics
+                )
+            SELECT
+                m.year,
+                m.race_k,
+                t.type_k,
+                m.id,
+                m.constructor_k,
+                mt.metric_k,
+                m.metric_value,
+                m.is_cumulative,
+                m.position
+            FROM
+                rankings AS m
+                INNER JOIN dim_type AS t
+                    ON m.type = t.type
+                INNER JOIN dim_metric AS mt
+                    ON m.metric = mt.metric
+            ORDER BY m.year, m.race_date, m.is_cumulative, m.metric, m.type, m.position DESC;
+        ''',
+        'indexes': [
+            '''
+                CREATE INDEX "report_season_metrics_year_metric_k_is_cumulative_position" ON "report_season_metrics" (
+                    "year",
+                    "metric_k",
+                    "is_cumulative",
+                    "position"
+                );
+            ''',
+        ],
+    },
+    {
+        'name': 'report_race_positions',
+        'depends_on': ['fact_lap', 'fact_race_result', 'dim_driver', 'dim_constructor'],
+        'schema': '''
+            CREATE TABLE report_race_positions (
+                race_k INTEGER PRIMARY KEY,
+                laps INTEGER NOT NULL,
+                dtype TEXT NOT NULL,
+                positions BLOB NOT NULL,
+                drivers TEXT NOT NULL
+            )
+        ''',
+        'sql': '''
+        --sql
+
+        -- the bump chart's lap positions, packed into one row per race by
+        -- packing.race_positions. drivers are drawn in constructor then name order
+        SELECT
+            l.race_k,
+            l.driver_k,
+            d.full_name AS driver_name,
+            COALESCE(d.code, '#NA') AS driver_code,
+            c.name AS constructor_name,
+            c.color AS constructor_color,
+            CASE WHEN l.is_final THEN rr.status END AS ending_status,
+            l.lap,
+            l.position
+        FROM
+            fact_lap AS l
+            LEFT JOIN fact_race_result AS rr
+                ON l.race_k = rr.race_k
+                AND l.driver_k = rr.driver_k
+            LEFT JOIN dim_driver AS d
+                ON l.driver_k = d.driver_k
+            LEFT JOIN dim_constructor AS c
+                ON rr.constructor_k = c.constructor_k
+        WHERE TRUE
+            AND NOT rr.is_sprint
+        ORDER BY l.race_k, c.name, d.full_name, l.driver_k, l.lap;
+        ''',
+        'indexes': [],
+        'shard': 'season',
+    },
+]
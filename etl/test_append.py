@@ -0,0 +1,120 @@
+import sqlite3
+
+import append
+import scheduler
+import steps
+
+
+# three seasons of three races. drivers 1-3 score every race, driver 4 only
+# enters 2019, so later seasons carry its total over, and driver 5 first
+# enters in 2021, for constructor 3
+races = [(race_k, 2019 + (race_k - 1) // 3) for race_k in range(1, 10)]
+results = [
+    (race_k, driver_k, 3 if driver_k == 5 else driver_k % 2 + 1, position, points)
+    for race_k, year in races
+    for position, (driver_k, points) in enumerate(
+        [
+            (race_k % 3 + 1, 25),
+            ((race_k + 1) % 3 + 1, 18),
+            ((race_k + 2) % 3 + 1, 15),
+            (4 if year == 2019 else 5 if year == 2021 else None, 10),
+        ],
+        start=1,
+    )
+    if driver_k is not None
+]
+
+
+def insert_entities(con, driver_ks, constructor_ks):
+    con.executemany('INSERT INTO dim_driver VALUES (?, ?, ?)', [(k, f'Driver {k}', f'wiki/driver{k}') for k in driver_ks])
+    con.executemany(
+        'INSERT INTO dim_constructor VALUES (?, ?, ?, ?)',
+        [(k, f'Team {k}', f'#00000{k}', f'wiki/team{k}') for k in constructor_ks],
+    )
+
+
+def create_warehouse(db_path, race_ks, driver_ks=range(1, 6), constructor_ks=range(1, 4)):
+    # the tables report_seasons_metrics reads, with results for race_ks only
+    # and the given drivers and constructors
+    con = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        con.execute('CREATE TABLE dim_season (year INTEGER, wiki_url TEXT)')
+        con.executemany('INSERT INTO dim_season VALUES (?, ?)', [(year, f'wiki/{year}') for year in [2019, 2020, 2021]])
+
+        con.execute('CREATE TABLE dim_race (race_k INTEGER, year INTEGER)')
+        con.executemany('INSERT INTO dim_race VALUES (?, ?)', races)
+
+        con.execute('CREATE TABLE dim_driver (driver_k INTEGER, full_name TEXT, wiki_url TEXT)')
+        con.execute('CREATE TABLE dim_constructor (constructor_k INTEGER, name TEXT, color TEXT, wiki_url TEXT)')
+        insert_entities(con, driver_ks, constructor_ks)
+
+        con.execute('CREATE TABLE dim_driver_constructor (year INTEGER, driver_k INTEGER, constructor_k INTEGER)')
+        con.executemany(
+            'INSERT INTO dim_driver_constructor VALUES (?, ?, ?)',
+            sorted({
+                (year, driver_k, constructor_k)
+                for race_k, year in races
+                for result_race_k, driver_k, constructor_k, _, _ in results
+                if result_race_k == race_k
+            }),
+        )
+
+        con.execute('''
+            CREATE TABLE fact_race_result (
+                race_k INTEGER,
+                driver_k INTEGER,
+                constructor_k INTEGER,
+                position INTEGER,
+                points REAL,
+                is_sprint INTEGER
+            )
+        ''')
+        con.executemany(
+            'INSERT INTO fact_race_result VALUES (?, ?, ?, ?, ?, 0)',
+            [row for row in results if row[0] in race_ks],
+        )
+    finally:
+        con.close()
+
+
+def test_append_spanning_seasons_matches_rebuild(tmp_path):
+    # the last race of 2020 and all of 2021 are appended to a table built
+    # without them
+    db_path = str(tmp_path / 'data.db')
+    build_dir = str(tmp_path / 'build')
+    step = next(step for step in steps.steps if step['name'] == 'report_seasons_metrics')
+
+    create_warehouse(db_path, range(1, 6))
+    scheduler.run([step], db_path, build_dir, max_workers=1)
+
+    con = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        con.executemany('INSERT INTO fact_race_result VALUES (?, ?, ?, ?, ?, 0)', [row for row in results if row[0] > 5])
+    finally:
+        con.close()
+
+    append.run([step], db_path, build_dir, list(range(6, 10)), [2020, 2021])
+
+    assert append.verify([step], db_path, build_dir) == []
+
+
+def test_append_with_new_driver_and_constructor_matches_rebuild(tmp_path):
+    # driver 5 and constructor 3 are only added to the dims along with the
+    # first race of 2021, which is appended to a table built without them
+    db_path = str(tmp_path / 'data.db')
+    build_dir = str(tmp_path / 'build')
+    step = next(step for step in steps.steps if step['name'] == 'report_seasons_metrics')
+
+    create_warehouse(db_path, range(1, 7), driver_ks=range(1, 5), constructor_ks=range(1, 3))
+    scheduler.run([step], db_path, build_dir, max_workers=1)
+
+    con = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        insert_entities(con, [5], [3])
+        con.executemany('INSERT INTO fact_race_result VALUES (?, ?, ?, ?, ?, 0)', [row for row in results if row[0] == 7])
+    finally:
+        con.close()
+
+    append.run([step], db_path, build_dir, [7], [2021])
+
+    assert append.verify([step], db_path, build_dir) == []